@@ -0,0 +1,246 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from shell_engine import ShellEngine, ROOT_DIR
+from vfs import VirtualFileSystem
+
+# Содержимое синтетических файлов — срезы одного буфера, чтобы генерация не упиралась в random
+_PAYLOAD = bytes(range(32, 127)) * 1024 + b"\n"
+
+
+class _PayloadReader:
+    """Файловый объект для tarfile.addfile: отдаёт первые size байт буфера _PAYLOAD по кругу."""
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        self.remaining -= size
+        chunks = []
+        while size > 0:
+            chunk = _PAYLOAD[:size]
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+
+def generate_archive(path, entries=1000, depth=3, fanout=10, min_size=0, max_size=4096, seed=0):
+    """Создаёт синтетический архив VFS с корнем papka примерно из entries записей.
+
+    Директории образуют полное дерево глубины depth с fanout поддиректориями
+    (не больше половины записей), остальные записи — файлы, разложенные по
+    всем директориям по кругу. Размеры файлов детерминированы seed.
+    Возвращает описание формы архива.
+    """
+    directories = [ROOT_DIR]
+    level = [ROOT_DIR]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                if len(directories) >= max(1, entries // 2):
+                    break
+                next_level.append(f"{parent}/d{i}")
+                directories.append(next_level[-1])
+        level = next_level
+        if not level:
+            break
+
+    files = max(0, entries - len(directories))
+    size_range = max_size - min_size + 1
+    mtime = int(time.time())
+    total_bytes = 0
+    with tarfile.open(path, 'w', format=tarfile.GNU_FORMAT) as tar:
+        for directory in directories:
+            info = tarfile.TarInfo(directory)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = mtime
+            tar.addfile(info)
+        for i in range(files):
+            info = tarfile.TarInfo(f"{directories[i % len(directories)]}/f{i}.txt")
+            # Линейный конгруэнтный генератор: воспроизводимые размеры без модуля random
+            info.size = min_size + (i * 2654435761 + seed) % size_range
+            info.mode = 0o644
+            info.mtime = mtime
+            total_bytes += info.size
+            tar.addfile(info, _PayloadReader(info.size))
+
+    return {"entries": len(directories) + files, "directories": len(directories), "files": files,
+            "depth": depth, "fanout": fanout, "min_size": min_size, "max_size": max_size,
+            "content_bytes": total_bytes, "archive_bytes": os.path.getsize(path)}
+
+
+def summarize(runs):
+    return {"runs": runs, "min": min(runs), "median": statistics.median(runs), "mean": statistics.fmean(runs)}
+
+
+def timed(function, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return summarize(runs)
+
+
+def make_engine(workdir, tar_path):
+    config_path = os.path.join(workdir, 'config.csv')
+    script_path = os.path.join(workdir, 'start_script.txt')
+    with open(script_path, 'w') as f:
+        f.write("ls\n")
+    with open(config_path, 'w', newline='') as f:
+        f.write("Path to VFS Archive,Path to Log File,Path to Start Script\n")
+        f.write(f"{tar_path},{os.path.join(workdir, 'log.xml')},{script_path}\n")
+    return ShellEngine(config_path)
+
+
+def run_benchmarks(tar_path, workdir, repeat=5, log_entries=10000):
+    """Замеряет основные операции эмулятора через ShellEngine без графического интерфейса."""
+    engine = make_engine(workdir, tar_path)
+    results = {}
+    lines = []
+
+    def command(text):
+        def run():
+            lines.clear()
+            engine.run_command(text, lines.append)
+        return run
+
+    try:
+        def load_cold():
+            engine.vfs.close()
+            engine.vfs = VirtualFileSystem.load(tar_path, use_index=False)
+
+        def load_warm():
+            engine.vfs.close()
+            engine.load_vfs()
+
+        results["load_vfs_cold"] = timed(load_cold, repeat)
+        # Первая загрузка с индексом строит его, дальше замеряется загрузка из индекса
+        load_warm()
+        results["load_vfs_warm"] = timed(load_warm, repeat)
+
+        root = engine.vfs.get(ROOT_DIR)
+        deepest = ROOT_DIR
+        node = root
+        while node is not None and any(child.is_dir for child in node.children.values()):
+            node = next(child for child in node.children.values() if child.is_dir)
+            deepest = f"{deepest}/{node.name}"
+        first_dir = deepest.split("/")[1] if "/" in deepest else None
+
+        results["ls"] = timed(command("ls"), repeat)
+        results["ls -l"] = timed(command("ls -l"), repeat)
+
+        def cd_deep():
+            engine.run_command(f"cd {deepest[len(ROOT_DIR) + 1:] or '.'}", lines.append)
+            engine.run_command("cd /", lines.append)
+        results["cd"] = timed(cd_deep, repeat)
+
+        results["find -name"] = timed(command("find -name f1*.txt"), repeat)
+        results["find -type"] = timed(command("find -type d"), repeat)
+        results["find -size"] = timed(command("find -type f -size +1K"), repeat)
+
+        if first_dir is not None:
+            def mv_subtree():
+                engine.run_command(f"mv {first_dir} bench_moved", lines.append)
+                engine.run_command(f"mv bench_moved {first_dir}", lines.append)
+            results["mv"] = timed(mv_subtree, repeat)
+            # Перемещения бенчмарка не должны попасть в overlay архива
+            engine.vfs.journal.clear()
+
+        def log_burst():
+            for i in range(log_entries):
+                engine.log_action(f"bench {i}")
+            engine.log_writer.flush()
+        results["log_action"] = timed(log_burst, repeat)
+        results["log_action"]["entries"] = log_entries
+    finally:
+        engine.shutdown()
+    return results
+
+
+def measure_memory(tar_path):
+    """Память дерева VFS (tracemalloc) при загрузке из архива и из индекса, в том числе на одну запись."""
+    report = {}
+    for source, use_index in (("tar", False), ("index", True)):
+        gc.collect()
+        tracemalloc.start()
+        vfs = VirtualFileSystem.load(tar_path, use_index=use_index)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        entries = sum(1 for _ in vfs.walk(vfs.root)) - 1  # Без корня дерева
+        vfs.close()
+        report[source] = {"entries": entries, "tree_bytes": current, "peak_bytes": peak,
+                          "bytes_per_entry": current / max(entries, 1)}
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности эмулятора на синтетическом архиве.")
+    parser.add_argument("--entries", type=int, default=1000, help="Число записей в архиве (1k … 1M)")
+    parser.add_argument("--depth", type=int, default=3, help="Глубина дерева директорий")
+    parser.add_argument("--fanout", type=int, default=10, help="Число поддиректорий в каждой директории")
+    parser.add_argument("--min-size", type=int, default=0, help="Минимальный размер файла, байт")
+    parser.add_argument("--max-size", type=int, default=4096, help="Максимальный размер файла, байт")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="Число повторов каждого замера")
+    parser.add_argument("--archive", help="Готовый архив вместо синтетического")
+    parser.add_argument("-o", "--output", help="Файл для результатов в JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.archive:
+            # Замеры идут на копии: индекс и overlay не должны появиться рядом с исходным архивом
+            tar_path = shutil.copy(args.archive, workdir)
+            shape = {"source": os.path.abspath(args.archive), "archive_bytes": os.path.getsize(tar_path)}
+        else:
+            tar_path = os.path.join(workdir, 'papka.tar')
+            start = time.perf_counter()
+            shape = generate_archive(tar_path, args.entries, args.depth, args.fanout,
+                                     args.min_size, args.max_size, args.seed)
+            shape["generate_seconds"] = time.perf_counter() - start
+
+        report = {
+            "timestamp": datetime.now().isoformat(),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "archive": shape,
+            "results": run_benchmarks(tar_path, workdir, args.repeat),
+        }
+        # Отдельный проход: под tracemalloc загрузка в несколько раз медленнее обычной
+        report["memory"] = measure_memory(tar_path)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import bisect
+import bz2
+import lzma
+import threading
+import zlib
+
+# Сигнатуры сжатых архивов
+COMPRESSION_MAGIC = {
+    "gz": b"\x1f\x8b",
+    "bz2": b"BZh",
+    "xz": b"\xfd7zXZ\x00",
+}
+READ_CHUNK = 64 * 1024
+OUTPUT_CHUNK = 1024 * 1024
+CHECKPOINT_INTERVAL = 4 * 1024 * 1024
+
+
+def detect_compression(path):
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    for kind, magic in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def new_decompressor(kind):
+    if kind == "gz":
+        return zlib.decompressobj(wbits=31)
+    if kind == "bz2":
+        return bz2.BZ2Decompressor()
+    return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+
+class _Cursor:
+    """Позиция распаковки: читает сжатый файл от контрольной точки вперёд."""
+
+    def __init__(self, archive, checkpoint):
+        position, compressed_position, state = checkpoint
+        self.archive = archive
+        self.magic = COMPRESSION_MAGIC[archive.kind]
+        self.file = open(archive.path, 'rb')
+        self.file.seek(compressed_position)
+        self.decompressor = state.copy() if state is not None else new_decompressor(archive.kind)
+        self.input = b""  # Сжатые данные, ещё не поглощённые распаковщиком
+        self.output_position = position  # Позиция в распакованном потоке конца buffer
+        self.buffer = b""
+        self.buffer_pos = 0
+        self.eof = False
+
+    @property
+    def position(self):
+        return self.output_position - (len(self.buffer) - self.buffer_pos)
+
+    def close(self):
+        self.file.close()
+
+    def _start_next_stream(self):
+        data = self.input
+        while len(data) < len(self.magic):
+            more = self.file.read(READ_CHUNK)
+            if not more:
+                break
+            data += more
+        if not data.startswith(self.magic):
+            # Выравнивающие нули или мусор после последнего потока
+            self.input = b""
+            return False
+        # Граница потоков (член gzip, поток bz2/xz): отсюда можно начать распаковку заново
+        self.archive.add_checkpoint(self.output_position, self.file.tell() - len(data), None)
+        self.decompressor = new_decompressor(self.archive.kind)
+        self.input = data
+        return True
+
+    def _next_output(self):
+        """Распаковывает очередную порцию не больше OUTPUT_CHUNK байт; b"" — конец архива."""
+        while True:
+            if self.decompressor.eof and not self._start_next_stream():
+                return b""
+            if self.archive.kind == "gz":
+                if not self.input:
+                    self.input = self.file.read(READ_CHUNK)
+                    if not self.input:
+                        return self.decompressor.flush()
+                output = self.decompressor.decompress(self.input, OUTPUT_CHUNK)
+                if self.decompressor.eof:
+                    self.input = self.decompressor.unused_data
+                else:
+                    self.input = self.decompressor.unconsumed_tail
+            else:
+                if self.input:
+                    data, self.input = self.input, b""
+                elif self.decompressor.needs_input:
+                    data = self.file.read(READ_CHUNK)
+                    if not data:
+                        return b""
+                else:
+                    data = b""
+                output = self.decompressor.decompress(data, OUTPUT_CHUNK)
+                if self.decompressor.eof:
+                    self.input = self.decompressor.unused_data
+            if output:
+                return output
+
+    def _fill(self):
+        output = self._next_output()
+        if not output:
+            self.eof = True
+            return b""
+        self.output_position += len(output)
+        if self.archive.kind == "gz" and not self.decompressor.eof:
+            # Состояние zlib соответствует уже поглощённым сжатым данным
+            self.archive.add_checkpoint(self.output_position, self.file.tell() - len(self.input),
+                                        self.decompressor)
+        return output
+
+    def skip(self, count):
+        available = len(self.buffer) - self.buffer_pos
+        if count <= available:
+            self.buffer_pos += count
+            return
+        count -= available
+        self.buffer = b""
+        self.buffer_pos = 0
+        while count > 0 and not self.eof:
+            output = self._fill()
+            if len(output) > count:
+                self.buffer = output
+                self.buffer_pos = count
+                return
+            count -= len(output)
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            if self.buffer_pos >= len(self.buffer):
+                if self.eof:
+                    break
+                self.buffer = self._fill()
+                self.buffer_pos = 0
+                continue
+            end = len(self.buffer) if size < 0 else min(len(self.buffer), self.buffer_pos + size)
+            pieces.append(self.buffer[self.buffer_pos:end])
+            if size > 0:
+                size -= end - self.buffer_pos
+            self.buffer_pos = end
+        return b"".join(pieces)
+
+
+class CompressedArchive:
+    """Произвольный доступ к сжатому (gzip, bz2, xz) tar-архиву через контрольные точки.
+
+    Контрольная точка — пара позиций в распакованном и сжатом потоках, с которой
+    можно начать распаковку. Границы потоков (многочленный gzip, многопоточные
+    bz2/xz) — полноценные точки перезапуска, они сохраняются в индексе VFS.
+    Для gzip дополнительно каждые CHECKPOINT_INTERVAL байт запоминается копия
+    состояния zlib; такие точки живут только в памяти сеанса.
+    """
+
+    def __init__(self, path, kind, checkpoints=(), interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.kind = kind
+        self.interval = interval
+        self.checkpoints = [(0, 0, None)]
+        self.positions = [0]
+        for position, compressed_position in checkpoints:
+            self.add_checkpoint(position, compressed_position, None)
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    def add_checkpoint(self, position, compressed_position, state):
+        index = bisect.bisect_right(self.positions, position)
+        previous = self.checkpoints[index - 1]
+        if state is not None:
+            # Копии состояния zlib держим не чаще, чем раз в interval байт
+            if position - previous[0] < self.interval:
+                return
+            state = state.copy()
+        elif previous[0] == position:
+            return
+        self.checkpoints.insert(index, (position, compressed_position, state))
+        self.positions.insert(index, position)
+
+    def restart_points(self):
+        """Точки перезапуска для сохранения в индексе."""
+        return [(position, compressed_position)
+                for position, compressed_position, state in self.checkpoints[1:] if state is None]
+
+    def stream(self):
+        """Файловый объект для последовательного прохода по архиву (первая загрузка)."""
+        return _Cursor(self, self.checkpoints[0])
+
+    def read(self, offset, size):
+        with self._lock:
+            cursor = self._cursor
+            # Продолжаем с текущей позиции, если до нужного места ближе, чем до контрольной точки
+            checkpoint = self.checkpoints[bisect.bisect_right(self.positions, offset) - 1]
+            if cursor is None or not (checkpoint[0] <= cursor.position <= offset):
+                if cursor is not None:
+                    cursor.close()
+                cursor = self._cursor = _Cursor(self, checkpoint)
+            cursor.skip(offset - cursor.position)
+            return cursor.read(size)
+
+    def close(self):
+        with self._lock:
+            if self._cursor is not None:
+                self._cursor.close()
+                self._cursor = None
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import json
+import time
+from shell_engine import percentile
+
+PROMPT_START = b"user@shell:"
+PROMPT_END = b"$ "
+# Смесь команд по умолчанию: навигация, листинг, поиск и mv в копии дерева сеанса
+DEFAULT_COMMANDS = ["ls", "ls -l", "cd bin", "ls", "cd ..", "find -type d -maxdepth 2", "find -name *.txt | wc -l",
+                    "mv bin load_test_bin", "mv load_test_bin bin", "du -s"]
+
+
+async def read_response(reader):
+    """Читает вывод команды до приглашения сервера; возвращает строки вывода."""
+    data = b""
+    while True:
+        data += await reader.readuntil(PROMPT_END)
+        # "$ " может встретиться и в выводе: приглашение — последняя строка без перевода строки
+        head, _, last = data.rpartition(b"\n")
+        if last.startswith(PROMPT_START):
+            return head.decode('utf-8', errors='replace').split("\n") if head else []
+
+
+async def connect(host=None, port=None, unix_path=None):
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+
+async def run_client(address, commands, repeat):
+    """Один клиент: повторяет список команд repeat раз, возвращает задержки команд в секундах."""
+    reader, writer = await connect(*address)
+    latencies = []
+    try:
+        await read_response(reader)
+        for _ in range(repeat):
+            for command in commands:
+                start = time.perf_counter()
+                writer.write((command + "\n").encode('utf-8'))
+                await writer.drain()
+                await read_response(reader)
+                latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return latencies
+
+
+async def run_load(address, clients=8, commands=None, repeat=10):
+    """Запускает clients параллельных сеансов и считает команды в секунду и задержки."""
+    commands = commands or DEFAULT_COMMANDS
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_client(address, commands, repeat) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result)
+    return {
+        "clients": clients,
+        "commands": len(latencies),
+        "seconds": elapsed,
+        "commands_per_second": len(latencies) / elapsed,
+        "latency_ms": {name: percentile(latencies, fraction) * 1000
+                       for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный клиент для сервера эмулятора (shell_server.py).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8022)
+    parser.add_argument("--unix", metavar="PATH", help="Подключаться к Unix-сокету вместо TCP")
+    parser.add_argument("--clients", type=int, default=8, help="Число параллельных сеансов")
+    parser.add_argument("--repeat", type=int, default=10, help="Сколько раз каждый сеанс повторяет список команд")
+    parser.add_argument("--script", help="Файл со списком команд вместо смеси по умолчанию")
+    parser.add_argument("-o", "--output", help="Файл для результатов в JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    commands = None
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            commands = [line.strip() for line in f if line.strip() and line.strip() != "exit"]
+
+    address = (args.host, args.port, args.unix)
+    report = asyncio.run(run_load(address, args.clients, commands, args.repeat))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import fnmatch
+import json
+import sys
+from datetime import datetime
+from session_log import iter_records, export_xml
+
+
+def parse_time(value):
+    """Время в формате ISO 8601 (2024-11-04T18:00 или 2024-11-04) в секунды эпохи."""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time '{value}', expected ISO 8601") from None
+
+
+def query(path, since=None, until=None, command=None):
+    """Записи лога в интервале времени; command — glob-шаблон строки команды."""
+    records = iter_records(path, since, until)
+    if command is not None:
+        records = (record for record in records if fnmatch.fnmatchcase(record.get("command", ""), command))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выборка записей из NDJSON-лога эмулятора по времени и команде.")
+    parser.add_argument("log", help="Файл лога (.ndjson); ротированные файлы log.1, log.2, ... читаются вместе с ним")
+    parser.add_argument("--since", type=parse_time, help="Начало интервала (ISO 8601)")
+    parser.add_argument("--until", type=parse_time, help="Конец интервала (ISO 8601)")
+    parser.add_argument("--command", help="Шаблон команды, например 'find*'")
+    parser.add_argument("--xml", metavar="FILE", help="Сохранить выборку в XML того же вида, что log.xml")
+    parser.add_argument("--count", action="store_true", help="Вывести только число записей")
+    args = parser.parse_args()
+
+    records = query(args.log, args.since, args.until, args.command)
+    if args.xml:
+        export_xml(records, args.xml)
+    elif args.count:
+        print(sum(1 for _ in records))
+    else:
+        for record in records:
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == '__main__':
+    main()
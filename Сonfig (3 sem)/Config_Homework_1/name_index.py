@@ -0,0 +1,164 @@
+GLOB_CHARS = "*?["
+
+
+def glob_literals(pattern):
+    """Литеральные фрагменты glob-шаблона между *, ? и классами символов [...]."""
+    fragments = []
+    current = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char in "*?":
+            fragments.append("".join(current))
+            current = []
+        elif char == "[":
+            # Конец класса ищется по тем же правилам, что и в fnmatch.translate
+            j = i + 1
+            if j < len(pattern) and pattern[j] == "!":
+                j += 1
+            if j < len(pattern) and pattern[j] == "]":
+                j += 1
+            j = pattern.find("]", j)
+            if j == -1:
+                current.append(char)  # Незакрытая скобка сравнивается буквально
+            else:
+                fragments.append("".join(current))
+                current = []
+                i = j
+        else:
+            current.append(char)
+        i += 1
+    fragments.append("".join(current))
+    return [fragment for fragment in fragments if fragment]
+
+
+def extension(name):
+    dot = name.rfind(".")
+    return name[dot + 1:] if dot != -1 else None
+
+
+class NameIndex:
+    """Вторичный индекс имён VFS для find -name.
+
+    by_name — имя -> список узлов с этим именем, by_ext — расширение -> узлы
+    (словарь как упорядоченное множество: удаление при mv за O(1)).
+    Триграммный индекс (триграмма -> множество имён) нужен только шаблонам
+    с подстроками и строится при первом таком запросе.
+    """
+
+    def __init__(self):
+        self.by_name = {}
+        self.by_ext = {}
+        self.trigrams = None
+        self.size = 0
+
+    @classmethod
+    def build(cls, root):
+        index = cls()
+        by_name = index.by_name
+        by_ext = index.by_ext
+        stack = list(root.children.values())
+        while stack:
+            node = stack.pop()
+            name = node.name
+            nodes = by_name.get(name)
+            if nodes is None:
+                by_name[name] = [node]
+            else:
+                nodes.append(node)
+            dot = name.rfind(".")
+            if dot != -1:
+                bucket = by_ext.get(name[dot + 1:])
+                if bucket is None:
+                    by_ext[name[dot + 1:]] = {node: None}
+                else:
+                    bucket[node] = None
+            if node.children:
+                stack.extend(node.children.values())
+        index.size = sum(len(nodes) for nodes in by_name.values())
+        return index
+
+    def add(self, node, name=None):
+        name = node.name if name is None else name
+        nodes = self.by_name.get(name)
+        if nodes is None:
+            self.by_name[name] = [node]
+            if self.trigrams is not None:
+                for i in range(len(name) - 2):
+                    self.trigrams.setdefault(name[i:i + 3], set()).add(name)
+        else:
+            nodes.append(node)
+        ext = extension(name)
+        if ext is not None:
+            self.by_ext.setdefault(ext, {})[node] = None
+        self.size += 1
+
+    def remove(self, node, name=None):
+        name = node.name if name is None else name
+        nodes = self.by_name[name]
+        nodes.remove(node)
+        if not nodes:
+            del self.by_name[name]
+            if self.trigrams is not None:
+                for i in range(len(name) - 2):
+                    bucket = self.trigrams[name[i:i + 3]]
+                    bucket.discard(name)
+                    if not bucket:
+                        del self.trigrams[name[i:i + 3]]
+        ext = extension(name)
+        if ext is not None:
+            bucket = self.by_ext[ext]
+            del bucket[node]
+            if not bucket:
+                del self.by_ext[ext]
+        self.size -= 1
+
+    def rename(self, node, old_name, new_name):
+        self.remove(node, old_name)
+        self.add(node, new_name)
+
+    def _build_trigrams(self):
+        trigrams = {}
+        for name in self.by_name:
+            for i in range(len(name) - 2):
+                bucket = trigrams.get(name[i:i + 3])
+                if bucket is None:
+                    trigrams[name[i:i + 3]] = {name}
+                else:
+                    bucket.add(name)
+        self.trigrams = trigrams
+
+    def candidates(self, pattern):
+        """Узлы, среди которых есть все совпадения с glob-шаблоном, или None,
+        если шаблон нельзя обслужить индексом (нужен полный обход).
+
+        Кандидаты — надмножество совпадений, их всё равно нужно проверить шаблоном.
+        """
+        if not any(char in pattern for char in GLOB_CHARS):
+            # Точное имя
+            return list(self.by_name.get(pattern, ()))
+
+        suffix = pattern[2:]
+        if pattern.startswith("*.") and suffix and not any(char in suffix for char in GLOB_CHARS):
+            # *.txt, *.tar.gz — по последнему расширению
+            return list(self.by_ext.get(extension(suffix) or suffix, ()))
+
+        fragments = [fragment for fragment in glob_literals(pattern) if len(fragment) >= 3]
+        if not fragments:
+            return None
+        if self.trigrams is None:
+            self._build_trigrams()
+        buckets = []
+        for fragment in fragments:
+            for i in range(len(fragment) - 2):
+                bucket = self.trigrams.get(fragment[i:i + 3])
+                if not bucket:
+                    return []
+                buckets.append(bucket)
+        buckets.sort(key=len)
+        names = set(buckets[0])
+        for bucket in buckets[1:]:
+            names &= bucket
+            if not names:
+                return []
+        return [node for name in names for node in self.by_name[name]]
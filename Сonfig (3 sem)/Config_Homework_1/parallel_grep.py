@@ -0,0 +1,246 @@
+import concurrent.futures
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+from collections import namedtuple
+from compressed_tar import CompressedArchive
+
+# Размер шарда: столько байт содержимого файлов обрабатывает один процесс за задачу
+SHARD_BYTES = 8 * 1024 * 1024
+# Меньшие поддеревья ищутся в текущем процессе: запуск пула дороже самого поиска
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+WAIT_INTERVAL = 0.1  # Период (с) проверки отмены команды при ожидании шардов
+
+GrepOptions = namedtuple("GrepOptions", "ignore_case invert files_only count_only numbered")
+
+
+# Конструкции, для которых поиск по всему файлу может пропустить строку:
+# \A и \Z в строке совпадают на её границах, а просмотр вокруг выходит за строку
+WHOLE_TEXT_SYNTAX = re.compile(r"\\[AZ]|\(\?<?[=!]")
+
+
+def compile_pattern(pattern, ignore_case):
+    """Шаблон ищется прямо в байтах архива; без учёта регистра для не-ASCII — по тексту."""
+    flags = re.IGNORECASE if ignore_case else 0
+    if ignore_case and not pattern.isascii():
+        return re.compile(pattern, flags), True
+    return re.compile(pattern.encode('utf-8'), flags), False
+
+
+def line_prefilter(regex):
+    """Многострочный вариант шаблона для поиска строк-кандидатов по всему файлу или None.
+
+    С re.MULTILINE ^ и $ совпадают на границах строк, поэтому совпадение,
+    не выходящее за строку, верно и для самой строки. Совпадение может
+    перейти через перевод строки — такие кандидаты затем проверяются
+    исходным шаблоном по одной строке.
+    """
+    source = regex.pattern if isinstance(regex.pattern, str) else regex.pattern.decode('utf-8', errors='replace')
+    if WHOLE_TEXT_SYNTAX.search(source):
+        return None
+    return re.compile(regex.pattern, regex.flags | re.MULTILINE)
+
+
+def _member_lines(data, start, end, newline):
+    """Строки файла в границах [start, end) без копирования содержимого."""
+    while start < end:
+        stop = data.find(newline, start, end)
+        if stop == -1:
+            stop = end
+        yield start, stop
+        start = stop + 1
+
+
+def scan_member(regex, prefilter, options, data, start, end, limit):
+    """Строки вывода grep для одного файла, не больше limit строк (None — без ограничения).
+
+    Шаблон проверяется по каждой строке отдельно, как в grep без -r:
+    ^ и $ совпадают на границах строки, а совпадение не переходит на следующую.
+    """
+    newline = "\n" if isinstance(data, str) else b"\n"
+    # Срезы memoryview не копируют строки из mmap
+    view = data if isinstance(data, str) else memoryview(data)
+    search = regex.search
+    lines = []
+
+    if prefilter is not None and not options.invert and not options.numbered:
+        # Без -v и -n не нужно разбирать все строки: переходим от кандидата к кандидату
+        member = view[start:end]
+        size = end - start
+        position = 0
+        while position < size and (limit is None or len(lines) < limit):
+            match = prefilter.search(member, position)
+            if match is None:
+                break
+            line_start = data.rfind(newline, start, start + match.start()) + 1 or start
+            if line_start >= end:
+                # Пустой остаток после последнего перевода строки — это не строка файла
+                break
+            line_end = data.find(newline, line_start, end)
+            if line_end == -1:
+                line_end = end
+            # Совпадение внутри строки верно и для неё самой, перешедшее через перевод строки — перепроверяем
+            if start + match.end() <= line_end or search(view[line_start:line_end]) is not None:
+                lines.append((None, line_start, line_end))
+                if options.files_only:
+                    break
+            position = line_end + 1 - start
+    else:
+        for number, (line_start, line_end) in enumerate(_member_lines(data, start, end, newline), 1):
+            if (search(view[line_start:line_end]) is not None) != options.invert:
+                lines.append((number, line_start, line_end))
+                if options.files_only or (limit is not None and len(lines) >= limit):
+                    break
+    return lines
+
+
+def scan_shard(source, pattern, options, entries, limit=None):
+    """Поиск по шарду в рабочем процессе.
+
+    source — (путь к tar, тип сжатия, точки перезапуска): архив открывается
+    в процессе заново, содержимое файлов между процессами не передаётся.
+    entries — список (номер, путь, смещение, размер). Возвращает список
+    (номер, строки вывода) в порядке номеров.
+    """
+    tar_path, kind, checkpoints = source
+    regex, text_mode = compile_pattern(pattern, options.ignore_case)
+    prefilter = line_prefilter(regex)
+    results = []
+    found = 0
+
+    archive = None
+    file = None
+    mapped = None
+    try:
+        if kind is not None:
+            archive = CompressedArchive(tar_path, kind, checkpoints)
+        else:
+            file = open(tar_path, 'rb')
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if limit is None:
+            # Читаем в порядке смещений, чтобы проход по архиву был последовательным
+            entries = sorted(entries, key=lambda entry: entry[2])
+        for index, path, offset, size in entries:
+            if limit is not None and found >= limit:
+                # С ограничением идём в порядке путей, чтобы не потерять более ранние результаты
+                break
+            if archive is not None or text_mode:
+                data = archive.read(offset, size) if archive is not None else mapped[offset:offset + size]
+                if text_mode:
+                    data = data.decode('utf-8', errors='replace')
+                start, end = 0, len(data)
+            else:
+                data, start, end = mapped, offset, offset + size
+
+            # Для -c считаются все совпадения в файле, ограничение — на число строк вывода
+            remaining = None if limit is None or options.count_only else limit - found
+            lines = scan_member(regex, prefilter, options, data, start, end, remaining)
+            if options.count_only:
+                output = [f"{path}:{len(lines)}"]
+            elif options.files_only:
+                output = [path] if lines else []
+            else:
+                output = []
+                for number, line_start, line_end in lines:
+                    text = data[line_start:line_end]
+                    if not text_mode:
+                        text = text.decode('utf-8', errors='replace')
+                    output.append(f"{path}:{number}:{text}" if options.numbered else f"{path}:{text}")
+            if output:
+                results.append((index, output))
+                found += len(output)
+    finally:
+        if mapped is not None:
+            mapped.close()
+        if file is not None:
+            file.close()
+        if archive is not None:
+            archive.close()
+
+    results.sort()
+    return results
+
+
+def make_shards(entries, shard_bytes=SHARD_BYTES):
+    """Делит файлы (в порядке путей) на непрерывные шарды примерно по shard_bytes байт."""
+    shard = []
+    shard_size = 0
+    for entry in entries:
+        shard.append(entry)
+        shard_size += entry[3]
+        if shard_size >= shard_bytes:
+            yield shard
+            shard = []
+            shard_size = 0
+    if shard:
+        yield shard
+
+
+class ContentSearch:
+    """Параллельный поиск по содержимому файлов VFS (grep -r).
+
+    Поддерево делится на шарды смещений файлов в архиве, шарды ищутся в пуле
+    процессов, каждый процесс сам читает tar. Результаты собираются в порядке
+    путей; при достижении max_results оставшиеся шарды отменяются. Пул
+    создаётся при первом большом поиске и живёт до close(). Объект общий
+    для потоков сеансов сервера, поэтому пул создаётся и закрывается под
+    блокировкой.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self.pool is None:
+                # spawn: в эмуляторе работают потоки лога и GUI, fork с ними небезопасен
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self.pool
+
+    def search(self, vfs, files, pattern, options, max_results=None, cancel=None):
+        """Строки вывода для файлов files — списка (путь, узел) в порядке путей."""
+        source = (vfs.tar_path, vfs.archive.kind if vfs.archive is not None else None,
+                  vfs.archive.restart_points() if vfs.archive is not None else [])
+        entries = [(index, path, node.offset, node.size) for index, (path, node) in enumerate(files)]
+        total = sum(entry[3] for entry in entries)
+        produced = 0
+
+        if self.workers == 1 or total < PARALLEL_MIN_BYTES:
+            for _, lines in scan_shard(source, pattern, options, entries, max_results):
+                for line in lines:
+                    yield line
+            return
+
+        pool = self._get_pool()
+        futures = [pool.submit(scan_shard, source, pattern, options, shard, max_results)
+                   for shard in make_shards(entries, max(SHARD_BYTES, total // (self.workers * 4)))]
+        try:
+            for future in futures:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        # Команда прервана: оставшиеся шарды не ждём, отмену обрабатывает вызывающий код
+                        return
+                    done, _ = concurrent.futures.wait([future], timeout=WAIT_INTERVAL)
+                    if done:
+                        break
+                for _, lines in future.result():
+                    for line in lines:
+                        yield line
+                        produced += 1
+                        if max_results is not None and produced >= max_results:
+                            return
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        with self._lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,379 @@
+import bisect
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+XML_HEADER = b"<?xml version='1.0' encoding='utf-8'?>\n<log>"
+ROOT_OPEN = b"<log>"
+ROOT_CLOSE = b"</log>"
+EMPTY_ROOT = b"<log />"
+
+# Режимы надёжности записи лога (колонка Log Durability в config.csv)
+DURABILITY_MODES = ("batched", "fsync")
+
+# Лог в формате NDJSON выбирается по расширению файла лога
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+INDEX_SUFFIX = ".idx"
+# Запись индекса: время записи лога (секунды эпохи) и её смещение в файле
+INDEX_RECORD = struct.Struct("<dQ")
+# Индексируется первая запись каждого такого блока лога
+INDEX_INTERVAL = 64 * 1024
+
+
+def _rfind(file, end, token, chunk_size=64 * 1024):
+    """Ищет последнее вхождение token в файле до позиции end, читая файл блоками с конца."""
+    pos = end
+    while pos > 0:
+        start = max(0, pos - chunk_size)
+        file.seek(start)
+        # Перекрытие блоков, чтобы не пропустить токен на границе
+        chunk = file.read(min(end, pos + len(token) - 1) - start)
+        index = chunk.rfind(token)
+        if index != -1:
+            return start + index
+        pos = start
+    return -1
+
+
+class StreamingXMLLog:
+    """Лог сеанса в формате XML, который дописывается в конец без перечитывания файла.
+
+    Файл остаётся открытым, каждая запись <entry> дописывается перед закрывающим
+    тегом. Корень </log> записывается при close(); если сеанс упал и тег не был
+    записан, файл восстанавливается при следующем открытии.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            file = open(self.path, 'wb')
+            file.write(XML_HEADER)
+            file.flush()
+            return file
+
+        file = open(self.path, 'r+b')
+        self._recover(file)
+        return file
+
+    def _recover(self, file):
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+
+        close_pos = _rfind(file, size, ROOT_CLOSE)
+        entry_end = _rfind(file, size, b"/>")
+        open_pos = _rfind(file, size, ROOT_OPEN)
+
+        if close_pos != -1 and close_pos > entry_end:
+            # Корректно закрытый лог: дописываем перед </log>
+            cut = close_pos
+        elif entry_end != -1 and entry_end > open_pos:
+            empty_pos = _rfind(file, entry_end + 2, EMPTY_ROOT)
+            if empty_pos != -1 and empty_pos + len(EMPTY_ROOT) == entry_end + 2:
+                # Пустой лог, записанный ElementTree как <log />
+                file.seek(empty_pos)
+                file.write(ROOT_OPEN)
+                cut = empty_pos + len(ROOT_OPEN)
+            else:
+                # Аварийное завершение: отбрасываем недописанный хвост после последней записи
+                cut = entry_end + 2
+        elif open_pos != -1:
+            cut = open_pos + len(ROOT_OPEN)
+        else:
+            # Файл не похож на лог — начинаем его заново
+            file.seek(0)
+            file.write(XML_HEADER)
+            cut = len(XML_HEADER)
+
+        file.truncate(cut)
+        file.seek(cut)
+        file.flush()
+
+    @staticmethod
+    def format_entry(attributes):
+        # Сериализация через ElementTree сохраняет экранирование атрибутов прежнего лога
+        entry = ET.Element("entry")
+        for key, value in attributes.items():
+            entry.set(key, value)
+        return ET.tostring(entry, encoding='unicode').encode('utf-8')
+
+    def write(self, attributes):
+        self.write_batch([attributes])
+
+    def write_batch(self, entries):
+        self.file.write(b"".join(self.format_entry(attributes) for attributes in entries))
+        self.file.flush()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.write(ROOT_CLOSE)
+        self.file.close()
+        self.file = None
+
+
+def record_time(attributes):
+    return datetime.fromisoformat(attributes["timestamp"]).timestamp()
+
+
+class NDJSONLog:
+    """Лог сеанса в формате NDJSON: одна запись — одна строка JSON.
+
+    Рядом с логом ведётся индекс времени (файл .idx, записи INDEX_RECORD):
+    первая запись каждых INDEX_INTERVAL байт лога, поэтому выборка по времени
+    начинается с нужного места файла, а не с начала. Лог ротируется при
+    превышении max_bytes байт или max_age секунд с первой записи: текущий
+    файл становится path.1 (старые сдвигаются до path.backups), индекс
+    переносится вместе с ним. Интерфейс совпадает со StreamingXMLLog.
+    """
+
+    def __init__(self, path, max_bytes=None, max_age=None, backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.file = None
+        self.index = None
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'a+b')
+        self.size = self.file.seek(0, os.SEEK_END)
+        last_newline = _rfind(self.file, self.size, b"\n") if self.size else -1
+        if last_newline != self.size - 1:
+            # Аварийное завершение: отбрасываем недописанную последнюю строку
+            self.size = last_newline + 1
+            self.file.truncate(self.size)
+
+        index_path = self.path + INDEX_SUFFIX
+        entries = read_index(index_path) if self.size else []
+        # Записи индекса за концом усечённого лога недействительны
+        entries = [entry for entry in entries if entry[1] < self.size]
+        self.index = open(index_path, 'wb' if not entries else 'r+b')
+        self.index.truncate(len(entries) * INDEX_RECORD.size)
+        self.index.seek(0, os.SEEK_END)
+        self.started = entries[0][0] if entries else None
+        self.indexed_until = entries[-1][1] + INDEX_INTERVAL if entries else 0
+
+    def write(self, attributes):
+        self.write_batch([attributes])
+
+    def write_batch(self, entries):
+        lines = []
+        index = []
+        position = self.size
+        for attributes in entries:
+            line = json.dumps(attributes, ensure_ascii=False, separators=(",", ":")).encode('utf-8') + b"\n"
+            if position >= self.indexed_until:
+                index.append(INDEX_RECORD.pack(record_time(attributes), position))
+                self.indexed_until = position + INDEX_INTERVAL
+                if self.started is None:
+                    self.started = record_time(attributes)
+            lines.append(line)
+            position += len(line)
+        self.file.write(b"".join(lines))
+        self.file.flush()
+        if index:
+            # Индекс пишется после самих записей: после сбоя он не ссылается на несуществующие строки
+            self.index.write(b"".join(index))
+            self.index.flush()
+        self.size = position
+        if self._should_rotate():
+            self.rotate()
+
+    def _should_rotate(self):
+        if self.max_bytes is not None and self.size >= self.max_bytes:
+            return True
+        return self.max_age is not None and self.started is not None and time.time() - self.started >= self.max_age
+
+    def rotate(self):
+        self.file.close()
+        self.index.close()
+        for number in range(self.backups - 1, 0, -1):
+            for suffix in ("", INDEX_SUFFIX):
+                source = f"{self.path}.{number}{suffix}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{number + 1}{suffix}")
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+            os.replace(self.path + INDEX_SUFFIX, f"{self.path}.1{INDEX_SUFFIX}")
+        else:
+            os.remove(self.path)
+            os.remove(self.path + INDEX_SUFFIX)
+        self._open()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        os.fsync(self.index.fileno())
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.index.close()
+        self.file = None
+        self.index = None
+
+
+def open_log(path, max_bytes=None, max_age=None, backups=5):
+    """Лог сеанса в формате, который задаётся расширением файла: NDJSON или XML."""
+    if path.endswith(NDJSON_EXTENSIONS):
+        return NDJSONLog(path, max_bytes, max_age, backups)
+    return StreamingXMLLog(path)
+
+
+def read_index(index_path):
+    """Записи индекса времени (время, смещение); неполная последняя запись отбрасывается."""
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % INDEX_RECORD.size
+    return list(INDEX_RECORD.iter_unpack(data[:usable]))
+
+
+def log_segments(path):
+    """Файлы лога от самого старого ротированного до текущего."""
+    segments = []
+    number = 1
+    while os.path.exists(f"{path}.{number}"):
+        segments.append(f"{path}.{number}")
+        number += 1
+    segments.reverse()
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+
+def iter_records(path, since=None, until=None):
+    """Записи NDJSON-лога (со всеми ротированными файлами) в интервале [since, until].
+
+    since и until — секунды эпохи. Чтение каждого файла начинается с последней
+    записи индекса не позже since и заканчивается на первой записи позже until.
+    """
+    for segment in log_segments(path):
+        entries = read_index(segment + INDEX_SUFFIX)
+        if entries and until is not None and entries[0][0] > until:
+            # Файлы идут по времени: в этом и следующих записей из интервала нет
+            return
+        start = 0
+        if entries and since is not None:
+            # Последняя запись индекса раньше since: все строки до неё тоже раньше since
+            position = bisect.bisect_left([entry[0] for entry in entries], since) - 1
+            start = entries[position][1] if position >= 0 else 0
+
+        with open(segment, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Строка, которую ещё дописывает работающий сеанс
+                try:
+                    attributes = json.loads(line)
+                except ValueError:
+                    continue
+                timestamp = record_time(attributes)
+                if since is not None and timestamp < since:
+                    continue
+                if until is not None and timestamp > until:
+                    return
+                yield attributes
+
+
+def export_xml(records, output_path):
+    """Сохраняет записи в XML того же вида, что пишет StreamingXMLLog."""
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    log = StreamingXMLLog(output_path)
+    try:
+        batch = []
+        for attributes in records:
+            batch.append(attributes)
+            if len(batch) >= 1024:
+                log.write_batch(batch)
+                batch.clear()
+        if batch:
+            log.write_batch(batch)
+    finally:
+        log.close()
+
+
+_STOP = object()
+
+
+class AsyncLogWriter:
+    """Асинхронная запись лога в фоновом потоке.
+
+    Записи попадают в ограниченную очередь (при переполнении write блокируется),
+    поток-писатель сбрасывает их пачками по batch_size записей или раз в
+    flush_interval секунд. В режиме "fsync" каждая запись синхронизируется с
+    диском отдельно, в режиме "batched" — одна синхронизация на пачку.
+    """
+
+    def __init__(self, writer, durability="batched", batch_size=256, flush_interval=0.5, max_queue=10000):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown log durability: {durability}")
+        self.writer = writer
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, attributes):
+        self.queue.put(attributes)
+
+    def flush(self):
+        # Ждём, пока поток-писатель запишет всё, что уже стоит в очереди
+        self.queue.join()
+
+    def close(self):
+        if not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.writer.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is _STOP
+            entries = batch[:-1] if stop else batch
+            try:
+                self._write(entries)
+            except OSError as e:
+                print(f"Error writing log: {e}")
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write(self, entries):
+        if not entries:
+            return
+        if self.durability == "fsync":
+            for attributes in entries:
+                self.writer.write(attributes)
+                self.writer.sync()
+        else:
+            self.writer.write_batch(entries)
+            self.writer.sync()
@@ -0,0 +1,972 @@
+import argparse
+import codecs
+import collections
+import contextlib
+import cProfile
+import csv
+import fnmatch
+import io
+import itertools
+import math
+import os
+import posixpath
+import pstats
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from vfs import VirtualFileSystem, CHUNK_SIZE, CACHED_FILE_BYTES
+from session_log import AsyncLogWriter, open_log
+from parallel_grep import ContentSearch, GrepOptions
+
+ROOT_DIR = "papka"  # Корневая директория
+CANCEL_CHECK_INTERVAL = 256  # Раз во сколько узлов обход проверяет отмену команды
+# find берёт кандидатов из индекса имён, если их меньше 1/INDEX_SELECTIVITY файлов поддерева
+INDEX_SELECTIVITY = 4
+
+
+def discard(stream):
+    """Выполняет поток до конца, ничего не отдавая."""
+    collections.deque(stream, maxlen=0)
+    yield from ()
+
+
+def percentile(ordered, fraction):
+    """Перцентиль по методу ближайшего ранга для отсортированного списка."""
+    rank = max(1, math.ceil(len(ordered) * fraction))
+    return ordered[rank - 1]
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """Профилирует блок через cProfile, если задан path.
+
+    Статистика сохраняется в path (формат pstats), а 20 самых дорогих по
+    суммарному времени функций печатаются в stderr.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(20)
+        sys.stderr.write(report.getvalue())
+
+
+def iter_lines(chunks):
+    """Разбивает поток байтовых блоков на строки без завершающего перевода строки."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    tail = ""
+    for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        yield from lines
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+class CommandCancelled(Exception):
+    """Выполнение команды прервано пользователем (Ctrl+C)."""
+
+
+class FindError(ValueError):
+    def __init__(self, *lines):
+        super().__init__(lines[0])
+        self.lines = lines
+
+
+class FindQuery:
+    """Скомпилированное выражение find.
+
+    Шаблон имени переводится в регулярное выражение, порог размера разбирается
+    один раз, а проверки выстраиваются в цепочку от дешёвых к дорогим.
+    Ограничения -mindepth/-maxdepth применяются при обходе, поэтому лишние
+    поддеревья не посещаются.
+    """
+
+    USAGE = ("Usage: find [directory] [-name pattern] [-type f|d] [-size [+|-]N[c|K|M|G]] "
+             "[-mindepth N] [-maxdepth N]")
+    VALID_TYPES = {"f", "d"}
+    SIZE_UNITS = {"": 1, "C": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    SIZE_PATTERN = re.compile(r"([+-]?)(\d+)([a-zA-Z]?)")
+
+    def __init__(self):
+        self.name_pattern = None  # Шаблон имени в виде glob
+        self.name_regex = None
+        self.type = None  # Тип файла: "f" (файл) или "d" (директория)
+        self.size_op = None  # "+" — больше, "-" — меньше, "" — не больше порога
+        self.size_limit = None
+        self.min_depth = 0
+        self.max_depth = None
+        self.predicates = []
+        self.visited = 0  # Число узлов, посещённых последним обходом
+
+    @classmethod
+    def parse(cls, args):
+        query = cls()
+        args = list(args)
+        while args:
+            param = args.pop(0)
+            if param == "-name":
+                if not args:
+                    raise FindError("find: missing argument to '-name'")
+                query.name_pattern = args.pop(0)
+            elif param == "-type":
+                if args and args[0] in cls.VALID_TYPES:
+                    query.type = args.pop(0)
+                else:
+                    raise FindError("find: invalid type; use 'f' for file or 'd' for directory")
+            elif param == "-size":
+                value = args.pop(0) if args else ""
+                match = cls.SIZE_PATTERN.fullmatch(value)
+                if not match or match.group(3).upper() not in cls.SIZE_UNITS:
+                    raise FindError(f"find: invalid argument '{value}' to '-size'", cls.USAGE)
+                query.size_op = match.group(1)
+                query.size_limit = int(match.group(2)) * cls.SIZE_UNITS[match.group(3).upper()]
+            elif param in ("-mindepth", "-maxdepth"):
+                value = args.pop(0) if args else ""
+                if not value.isdigit():
+                    raise FindError(f"find: invalid argument '{value}' to '{param}'", cls.USAGE)
+                if param == "-mindepth":
+                    query.min_depth = int(value)
+                else:
+                    query.max_depth = int(value)
+            else:
+                raise FindError(f"find: invalid option -- '{param}'", cls.USAGE)
+        query.compile()
+        return query
+
+    def compile(self):
+        predicates = []
+        # Сначала самые дешёвые проверки: тип, затем размер, и только потом регулярное выражение
+        if self.type == "f":
+            predicates.append(lambda node: not node.is_dir)
+        elif self.type == "d":
+            predicates.append(lambda node: node.is_dir)
+
+        if self.size_limit is not None:
+            limit = self.size_limit
+            if self.size_op == "+":
+                predicates.append(lambda node: node.size > limit)
+            elif self.size_op == "-":
+                predicates.append(lambda node: node.size < limit)
+            else:
+                predicates.append(lambda node: node.size <= limit)
+
+        if self.name_pattern is not None:
+            # fnmatch.translate экранирует метасимволы регулярных выражений в шаблоне
+            self.name_regex = re.compile(fnmatch.translate(self.name_pattern))
+            match = self.name_regex.match
+            predicates.append(lambda node: match(node.name) is not None)
+
+        self.predicates = predicates
+
+    def matches(self, node):
+        for predicate in self.predicates:
+            if not predicate(node):
+                return False
+        return True
+
+    def search(self, vfs, start_node, start_path, cancel=None):
+        """Обход поддерева с отсечением по глубине, отдаёт пути подходящих узлов.
+
+        Если у шаблона -name подходящая форма (точное имя, *.ext, подстроки
+        от трёх символов), кандидаты берутся из индекса имён VFS, а полный
+        обход не выполняется. cancel — threading.Event; если он установлен,
+        обход прерывается исключением CommandCancelled. Число посещённых
+        узлов сохраняется в self.visited после завершения обхода.
+        """
+        candidates = self.indexed_candidates(vfs, start_node)
+        if candidates is not None:
+            yield from self.search_candidates(vfs, candidates, start_node, start_path, cancel)
+            return
+
+        max_depth = self.max_depth
+        min_depth = self.min_depth
+        stack = [(start_path, start_node, 0)]
+        visited = 0
+        try:
+            while stack:
+                # Флаг отмены проверяем не на каждом узле, чтобы не замедлять обход
+                if cancel is not None and visited % CANCEL_CHECK_INTERVAL == 0 and cancel.is_set():
+                    raise CommandCancelled()
+                visited += 1
+                path, node, depth = stack.pop()
+                if depth >= min_depth and self.matches(node):
+                    yield path
+                if node.is_dir and (max_depth is None or depth < max_depth):
+                    prefix = path + "/" if path else ""
+                    for child in reversed(list(node.children.values())):
+                        stack.append((prefix + child.name, child, depth + 1))
+        finally:
+            self.visited = visited
+
+    def indexed_candidates(self, vfs, start_node):
+        """Кандидаты из индекса имён или None, если выгоднее обычный обход."""
+        if self.name_pattern is None or vfs.name_index is None:
+            return None
+        candidates = vfs.name_index.candidates(self.name_pattern)
+        # Если под шаблон подходит заметная часть дерева, сортировка кандидатов дороже обхода
+        if candidates is None or len(candidates) * INDEX_SELECTIVITY >= max(start_node.file_count, 1):
+            return None
+        return candidates
+
+    def search_candidates(self, vfs, candidates, start_node, start_path, cancel=None):
+        """Проверяет кандидатов из индекса и отдаёт их пути в порядке обхода дерева."""
+        positions = {}  # Директория -> {имя ребёнка: порядковый номер}
+        hits = []
+        visited = 0
+        if cancel is not None and cancel.is_set():
+            raise CommandCancelled()
+        try:
+            for node in candidates:
+                visited += 1
+                if cancel is not None and visited % CANCEL_CHECK_INTERVAL == 0 and cancel.is_set():
+                    raise CommandCancelled()
+                if not self.matches(node):
+                    continue
+                # Подъём к start_node: проверка поддерева и глубины
+                chain = []
+                current = node
+                while current is not None and current is not start_node:
+                    chain.append(current)
+                    current = vfs.parent_of(current)
+                depth = len(chain)
+                if current is None or depth < self.min_depth or (
+                        self.max_depth is not None and depth > self.max_depth):
+                    continue
+                # Ключ сортировки — номера узлов среди детей родителя на пути от start_node,
+                # так результаты выходят в том же порядке, что и при обходе
+                key = []
+                names = []
+                parent = start_node
+                for child in reversed(chain):
+                    order = positions.get(parent)
+                    if order is None:
+                        order = positions[parent] = {name: i for i, name in enumerate(parent.children)}
+                    key.append(order[child.name])
+                    names.append(child.name)
+                    parent = child
+                hits.append((key, names))
+        finally:
+            self.visited = visited
+
+        hits.sort(key=lambda hit: hit[0])
+        for _, names in hits:
+            yield "/".join([start_path, *names]) if start_path else "/".join(names)
+
+
+class ShellEngine:
+    """Ядро эмулятора без графического интерфейса.
+
+    Команды (ls, cd, echo, mv, find) — генераторы строк вывода, поэтому ядро
+    работает и под Tkinter, и в пакетном режиме без дисплея. Команды из
+    STDIN_COMMANDS дополнительно принимают stdin — итератор строк предыдущей
+    команды конвейера. Долгие обходы проверяют cancel_event, поэтому команду
+    можно прервать из другого потока.
+    """
+
+    COMMANDS = ("ls", "cd", "echo", "mv", "find", "du", "sync", "cat", "head", "tail", "grep", "wc", "stats")
+    STDIN_COMMANDS = ("cat", "head", "tail", "grep", "wc")
+
+    def __init__(self, config_path='config.csv'):
+        self.cwd = ROOT_DIR
+        self.vfs = VirtualFileSystem()
+        self.log_file = 'log.xml'
+        self.config_path = config_path
+        self.running = True
+        # Устанавливается из другого потока (Ctrl+C в GUI), чтобы прервать текущую команду
+        self.cancel_event = threading.Event()
+        self.content_search = None  # Пул процессов для grep -r создаётся при первом поиске
+        self.visited = 0  # Узлы VFS, посещённые текущей командой
+        self.command_stats = collections.defaultdict(list)  # Время выполнения команд сеанса
+        self.load_config()
+        self.load_vfs()
+        log = open_log(self.log_file, self.log_max_bytes, self.log_max_age, self.log_backups)
+        self.log_writer = AsyncLogWriter(log, self.log_durability)
+        self.log_action("Session started")
+
+    def load_config(self):
+        with open(self.config_path, newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                self.vfs_path = row['Path to VFS Archive']
+                self.log_file = row['Path to Log File']
+                self.start_script = row['Path to Start Script']
+                self.log_durability = row.get('Log Durability') or 'batched'
+                # Ротация лога в формате NDJSON: по размеру (байт) и возрасту (секунд)
+                self.log_max_bytes = int(row['Log Max Bytes']) if row.get('Log Max Bytes') else None
+                self.log_max_age = float(row['Log Max Age']) if row.get('Log Max Age') else None
+                self.log_backups = int(row.get('Log Backups') or 5)
+                # Размер прокрутки окна вывода, используется графическим интерфейсом
+                self.scrollback_lines = int(row.get('Scrollback Lines') or 10000)
+
+    def load_vfs(self):
+        # Дерево берётся из индекса рядом с архивом, если архив не менялся
+        self.vfs = VirtualFileSystem.load(self.vfs_path)
+
+    def log_action(self, action, result=None, metrics=None):
+        entry = {"timestamp": datetime.now().isoformat(), "command": action}
+        if result is not None:
+            entry["result"] = result
+        if metrics:
+            entry.update(metrics)
+        self.log_writer.write(entry)
+
+    def shutdown(self):
+        # Сохраняем несинхронизированные изменения VFS, дописываем очередь лога,
+        # закрываем корень XML-лога и файл архива
+        self.vfs.sync()
+        self.log_writer.close()
+        self.vfs.close()
+        if self.content_search is not None:
+            self.content_search.close()
+
+    def prompt_text(self):
+        prompt_path = "~" if self.cwd == ROOT_DIR else self.cwd.replace(ROOT_DIR + "/", "~/")
+        return f"user@shell:{prompt_path}$ "
+
+    def run_command(self, command, output):
+        """Выполняет одну команду, передавая каждую строку вывода в output(line)."""
+        pipeline = self.build_pipeline(command)
+        if pipeline is None:
+            return
+        stream, result = pipeline
+        self.run_pipeline(command, stream, result, output)
+
+    def build_pipeline(self, command):
+        """Разбирает команду и соединяет команды конвейера (cmd1 | cmd2) как ленивые итераторы.
+
+        Обработчики команд вызываются сразу, но это только создаёт генераторы:
+        сама работа выполняется в run_pipeline, в том числе в другом потоке.
+        Возвращает (поток строк, результат для лога) или None для пустой строки.
+        """
+        stages = [stage.split() for stage in command.split("|")]
+        if len(stages) == 1 and not stages[0]:
+            return None
+
+        if stages[0][:1] == ["time"]:
+            # time cmd: вывод команды, затем её время выполнения
+            stages[0] = stages[0][1:]
+            if len(stages) == 1 and not stages[0]:
+                return self.time_stream(iter(())), None
+            stream, result = self.build_pipeline(" | ".join(" ".join(stage) for stage in stages))
+            return self.time_stream(stream), result
+
+        if not all(stages):
+            result = "syntax error near unexpected token `|'"
+            return iter([result]), result
+
+        result = None
+        stream = None
+        for cmd, *args in stages:
+            if cmd in self.COMMANDS:
+                handler = getattr(self, cmd)
+                if stream is not None and cmd in self.STDIN_COMMANDS:
+                    stream = handler(args, stdin=stream)
+                elif stream is not None:
+                    # Команда не читает stdin: вывод предыдущей команды отбрасывается
+                    stream = itertools.chain(discard(stream), handler(args))
+                else:
+                    stream = handler(args)
+            elif cmd == "exit":
+                self.running = False
+                stream = None
+            else:
+                result = f"Command not found: {cmd}"
+                stream = iter([result])
+
+        return (stream if stream is not None else iter(())), result
+
+    def run_pipeline(self, command, stream, result, output):
+        """Выполняет подготовленный конвейер и записывает в лог время и число посещённых узлов."""
+        self.cancel_event.clear()
+        self.visited = 0
+        wall_start = time.perf_counter()
+        # Время процессора рабочего потока, без потока записи лога
+        cpu_start = time.thread_time()
+        try:
+            for line in stream:
+                output(line)
+                if self.cancel_event.is_set():
+                    raise CommandCancelled()
+        except CommandCancelled:
+            output("^C")
+            result = "Cancelled"
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+
+        self.command_stats[self.command_key(command)].append(wall)
+        self.log_action(command, result, {"wall_ms": f"{wall * 1000:.3f}", "cpu_ms": f"{cpu * 1000:.3f}",
+                                          "visited": str(self.visited)})
+
+    @staticmethod
+    def command_key(command):
+        """Имя команды для статистики: имена команд конвейера без аргументов."""
+        names = [stage.split()[0] for stage in command.split("|") if stage.split()]
+        if names and names[0] == "time" and len(command.split()) > 1:
+            names[0] = command.split()[1]
+        return " | ".join(names)
+
+    def time_stream(self, stream):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        visited = self.visited
+        yield from stream
+        yield f"real\t{time.perf_counter() - wall_start:.3f}s"
+        yield f"cpu\t{time.thread_time() - cpu_start:.3f}s"
+        yield f"visited\t{self.visited - visited}"
+
+    def stats(self, args):
+        if not self.command_stats:
+            yield "stats: no commands in this session"
+            return
+        yield f"{'command':<20} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+        for name, samples in sorted(self.command_stats.items()):
+            ordered = sorted(samples)
+            latencies = [percentile(ordered, fraction) for fraction in (0.5, 0.9, 0.99)] + [ordered[-1]]
+            yield f"{name:<20} {len(ordered):>6} " + " ".join(f"{value * 1000:>9.3f}" for value in latencies)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise CommandCancelled()
+
+    def run_script(self, lines, output):
+        """Выполняет команды скрипта, печатая перед каждой приглашение, как в терминале."""
+        for command in lines:
+            command = command.strip()
+            if not command:
+                continue
+            output(f"{self.prompt_text()}{command}")
+            self.run_command(command, output)
+            if not self.running:
+                break
+
+    def ls(self, args):
+        path = self.cwd
+        node = self.vfs.get(path)
+        if node is None:
+            yield "Directory not found"
+            return
+        if not node.is_dir:
+            yield f"{path} is not a directory"
+            return
+
+        long_format = "-l" in args
+        human_readable = "-h" in args
+
+        for child in node.children.values():
+            self.check_cancelled()
+            self.visited += 1
+            size = child.size
+
+            # Флаг -h
+            size_display = self.human_readable_size(size) if human_readable else str(size)
+
+            if long_format:
+                type_flag = 'd' if child.is_dir else '-'
+                permissions = "rw-rw-r--"
+                owner = "user"
+                group = "user"
+                last_modified = time.strftime('%b %d %H:%M', time.localtime(child.mtime))
+
+                yield f"{type_flag}{permissions} 1 {owner} {group} {size_display} {last_modified} {child.name}"
+            else:
+                yield child.name
+
+    def human_readable_size(self, size):
+        if size < 1024:
+            return f"{size} B"
+        elif size < 1024 ** 2:
+            return f"{size / 1024:.1f} KB"
+        elif size < 1024 ** 3:
+            return f"{size / (1024 ** 2):.1f} MB"
+        else:
+            return f"{size / (1024 ** 3):.1f} GB"
+
+    def get_size_recursive(self, path):
+        # Размер поддерева поддерживается деревом VFS и не пересчитывается
+        node = self.vfs.get(path)
+        if node is None:
+            return 0
+        return node.total_size
+
+    def ls_recursive(self, path):
+        node = self.vfs.get(path)
+        if node is None or not node.is_dir:
+            return
+        yield f"{path}:"
+        yield from node.children
+        yield ""
+
+        for child in node.children.values():
+            self.check_cancelled()
+            if child.is_dir:
+                yield from self.ls_recursive(f"{path}/{child.name}")
+
+    def cd(self, args):
+        # Проверяем, если введенные аргументы валидны
+        if len(args) > 1:
+            yield "cd: too many arguments"
+            return
+
+        # Перемещение на один каталог вверх
+        if not args:
+            self.cwd = ROOT_DIR
+            return
+
+        path = args[0]
+
+        if path == "..":  # Переход на один уровень вверх
+            if self.cwd != ROOT_DIR:
+                self.cwd = "/".join(self.cwd.split("/")[:-1]) or ROOT_DIR
+        elif path == "-":  # Возвращение в предыдущий каталог
+            if hasattr(self, 'prev_cwd'):
+                self.cwd, self.prev_cwd = self.prev_cwd, self.cwd
+            else:
+                yield "No previous directory"
+        elif path == "/":  # Переход в корневую директорию
+            self.cwd = ROOT_DIR
+        else:
+            # Нормализация пути
+            components = self.cwd.strip("/").split("/") + path.split("/")
+            normalized_components = []
+
+            for component in components:
+                if component == "" or component == ".":  # Пропускаем пустые и текущие директории
+                    continue
+                elif component == "..":
+                    if normalized_components:
+                        normalized_components.pop()
+                else:
+                    normalized_components.append(component)
+
+            full_vfs_path = "/".join(normalized_components).strip("/")
+
+            # Проверяем, существует ли целевой путь в VFS и является ли он директорией
+            target = self.vfs.get(full_vfs_path)
+            self.visited += 1
+            if target is not None and target.is_dir:
+                self.prev_cwd = self.cwd
+                self.cwd = full_vfs_path
+            else:
+                yield f"cd: no such file or directory: {path}"
+
+    def echo(self, args):
+        yield " ".join(args)
+
+    def mv(self, args):
+        if len(args) < 2:
+            yield "mv: missing file operand"
+            return
+
+        destination = args[-1]
+        sources = args[:-1]
+
+        # Определяем полный путь назначения
+        if destination.startswith("/"):
+            full_destination = destination.strip("/")
+        else:
+            full_destination = "/".join([self.cwd.strip("/"), destination]).strip("/")
+
+        destination_node = self.vfs.get(full_destination)
+        is_directory = destination_node is not None and destination_node.is_dir
+
+        for source in sources:
+            if source.startswith("/"):
+                full_source = source.strip("/")
+            else:
+                full_source = "/".join([self.cwd.strip("/"), source]).strip("/")
+
+            source_node = self.vfs.get(full_source)
+            self.visited += 1
+            if source_node is None:
+                yield f"mv: cannot stat '{source}': No such file or directory"
+                continue
+
+            if is_directory:
+                new_parent = destination_node
+                new_name = source_node.name
+            else:
+                parent_path, _, new_name = full_destination.rpartition("/")
+                new_parent = self.vfs.get(parent_path)
+
+            if new_parent is None or not new_parent.is_dir:
+                yield f"mv: cannot move '{source}' to '{destination}': No such file or directory"
+                continue
+
+            try:
+                self.vfs.move(source_node, new_parent, new_name)
+            except ValueError as e:
+                yield f"mv: cannot move '{source}' to '{destination}': {e}"
+
+        # Уведомление о результате перемещения
+        yield f"Moved {', '.join(sources)} to {destination}"
+
+    def du(self, args):
+        human_readable = "-h" in args
+        summarize = "-s" in args
+        inodes = "--inodes" in args
+        paths = [arg for arg in args if not arg.startswith("-")]
+        if len(paths) > 1:
+            yield "du: too many arguments"
+            return
+
+        path = paths[0] if paths else "."
+        node = self.vfs.get(self.resolve_path(path))
+        if node is None:
+            yield f"du: cannot access '{path}': No such file or directory"
+            return
+
+        def usage(item):
+            # Ответ берётся из агрегатов узла без обхода поддерева
+            if inodes:
+                return str(item.file_count if item.is_dir else 1)
+            size = item.size + item.total_size
+            return self.human_readable_size(size) if human_readable else str(size)
+
+        if summarize or not node.is_dir:
+            yield f"{usage(node)}\t{path}"
+            return
+
+        # Обход директорий в обратном порядке: вложенные выводятся раньше родителя
+        stack = [(path, node, False)]
+        while stack:
+            item_path, item, expanded = stack.pop()
+            if expanded:
+                self.visited += 1
+                yield f"{usage(item)}\t{item_path}"
+                continue
+            stack.append((item_path, item, True))
+            for child in reversed(list(item.children.values())):
+                if child.is_dir:
+                    stack.append((f"{item_path}/{child.name}", child, False))
+
+    def sync(self, args):
+        count = self.vfs.sync()
+        if count:
+            yield f"sync: {count} change(s) written to {self.vfs.overlay_path}"
+
+    def resolve_path(self, path):
+        """Путь относительно текущей директории в виде пути VFS."""
+        if path.startswith("/"):
+            full_path = path.strip("/")
+        else:
+            full_path = "/".join([self.cwd.strip("/"), path]).strip("/")
+        return posixpath.normpath(full_path) if full_path else full_path
+
+    def open_file(self, cmd, path):
+        """Узел файла для команд чтения или строка ошибки."""
+        node = self.vfs.get(self.resolve_path(path))
+        self.visited += 1
+        if node is None:
+            return None, f"{cmd}: {path}: No such file or directory"
+        if node.is_dir:
+            return None, f"{cmd}: {path}: Is a directory"
+        return node, None
+
+    def file_lines(self, node):
+        return iter_lines(self.vfs.iter_chunks(node))
+
+    @staticmethod
+    def parse_count(cmd, args, default=10):
+        """Разбирает -n N и -N для head/tail, возвращает (N, оставшиеся аргументы)."""
+        count = default
+        rest = []
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+            if arg == "-n":
+                value = args.pop(0) if args else ""
+            elif arg.startswith("-n"):
+                value = arg[2:]
+            elif arg.startswith("-") and arg[1:].isdigit():
+                value = arg[1:]
+            else:
+                rest.append(arg)
+                continue
+            if not value.isdigit():
+                raise ValueError(f"{cmd}: invalid number of lines: '{value}'")
+            count = int(value)
+        return count, rest
+
+    def cat(self, args, stdin=None):
+        if not args:
+            if stdin is not None:
+                yield from stdin
+            return
+        for path in args:
+            node, error = self.open_file("cat", path)
+            if error:
+                yield error
+                continue
+            yield from self.file_lines(node)
+
+    def head(self, args, stdin=None):
+        try:
+            count, paths = self.parse_count("head", args)
+        except ValueError as e:
+            yield str(e)
+            return
+
+        if not paths:
+            if stdin is not None:
+                # islice перестаёт читать предыдущую команду после count строк
+                yield from itertools.islice(stdin, count)
+            return
+        for path in paths:
+            node, error = self.open_file("head", path)
+            if error:
+                yield error
+                continue
+            if len(paths) > 1:
+                yield f"==> {path} <=="
+            # Читаются только блоки, в которые попадают первые count строк
+            yield from itertools.islice(self.file_lines(node), count)
+
+    def tail_lines(self, node, count):
+        """Последние count строк файла: блоки читаются с конца, пока не наберётся count строк."""
+        if count == 0:
+            return []
+        if node.size <= CACHED_FILE_BYTES:
+            # Маленький файл целиком берётся из кэша, как в iter_chunks
+            data = self.vfs.read_cached(node)
+            end = 0
+        else:
+            data = b""
+            end = node.size
+        # Нужен count + 1 перевод строки: последний может завершать файл
+        while end > 0 and data.count(b"\n") <= count:
+            start = max(0, end - CHUNK_SIZE)
+            data = self.vfs.read_range(node, start, end - start) + data
+            end = start
+        lines = data.decode('utf-8', errors='replace').split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        return lines[-count:]
+
+    def tail(self, args, stdin=None):
+        try:
+            count, paths = self.parse_count("tail", args)
+        except ValueError as e:
+            yield str(e)
+            return
+
+        if not paths:
+            if stdin is not None and count:
+                yield from collections.deque(stdin, maxlen=count)
+            return
+        for path in paths:
+            node, error = self.open_file("tail", path)
+            if error:
+                yield error
+                continue
+            if len(paths) > 1:
+                yield f"==> {path} <=="
+            yield from self.tail_lines(node, count)
+
+    def grep(self, args, stdin=None):
+        flags = set()
+        operands = []
+        max_results = None
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+            if arg == "--max-results":
+                value = args.pop(0) if args else ""
+                if not value.isdigit():
+                    yield f"grep: invalid max results: '{value}'"
+                    return
+                max_results = int(value)
+            elif arg.startswith("--"):
+                flags.add(arg)
+            elif arg.startswith("-") and len(arg) > 1:
+                # Короткие флаги можно объединять: -rn
+                flags.update(f"-{flag}" for flag in arg[1:])
+            else:
+                operands.append(arg)
+        if flags - {"-r", "-i", "-v", "-c", "-l", "-n"} or not operands:
+            yield "Usage: grep [-r] [-i] [-v] [-c] [-l] [-n] [--max-results N] pattern [file...]"
+            return
+
+        try:
+            regex = re.compile(operands[0], re.IGNORECASE if "-i" in flags else 0)
+        except re.error as e:
+            yield f"grep: invalid pattern: {e}"
+            return
+        options = GrepOptions(ignore_case="-i" in flags, invert="-v" in flags, files_only="-l" in flags,
+                              count_only="-c" in flags, numbered="-n" in flags)
+        paths = operands[1:]
+
+        if "-r" in flags:
+            yield from self.grep_recursive(operands[0], options, paths or ["."], max_results)
+            return
+
+        if paths:
+            sources = []
+            for path in paths:
+                node, error = self.open_file("grep", path)
+                sources.append((path, None, error) if error else (path, node, None))
+        else:
+            sources = [("(standard input)", None, None)]
+
+        produced = 0
+        for path, node, error in sources:
+            if error:
+                yield error
+                continue
+            if node is None:
+                lines = stdin if stdin is not None else iter(())
+            else:
+                lines = self.file_lines(node)
+            prefix = f"{path}:" if len(paths) > 1 else ""
+            matches = 0
+            for number, line in enumerate(lines, 1):
+                if max_results is not None and produced >= max_results:
+                    return
+                if (regex.search(line) is not None) != options.invert:
+                    matches += 1
+                    if options.files_only:
+                        break
+                    if not options.count_only:
+                        produced += 1
+                        yield f"{prefix}{number}:{line}" if options.numbered else f"{prefix}{line}"
+            if options.files_only and matches:
+                produced += 1
+                yield path
+            elif options.count_only:
+                produced += 1
+                yield f"{prefix}{matches}"
+
+    def grep_recursive(self, pattern, options, paths, max_results):
+        """grep -r: файлы поддеревьев ищутся параллельно в пуле процессов."""
+        files = []
+        for path in paths:
+            node = self.vfs.get(self.resolve_path(path))
+            if node is None:
+                yield f"grep: {path}: No such file or directory"
+                continue
+            for item in self.vfs.walk(node):
+                self.visited += 1
+                if not item[1].is_dir:
+                    files.append(item)
+
+        if self.content_search is None:
+            self.content_search = ContentSearch()
+        yield from self.content_search.search(self.vfs, files, pattern, options, max_results, self.cancel_event)
+        self.check_cancelled()
+
+    def wc(self, args, stdin=None):
+        flags = {arg for arg in args if arg.startswith("-")}
+        paths = [arg for arg in args if not arg.startswith("-")]
+        if flags - {"-l", "-w", "-c"}:
+            yield "Usage: wc [-l] [-w] [-c] [file...]"
+            return
+        # Без флагов выводятся все три счётчика, как в wc
+        selected = [flag for flag in ("-l", "-w", "-c") if flag in flags] or ["-l", "-w", "-c"]
+
+        def format_counts(counts, name):
+            values = [str(counts[flag]) for flag in selected]
+            return " ".join(values + ([name] if name else []))
+
+        if not paths:
+            counts = {"-l": 0, "-w": 0, "-c": 0}
+            for line in stdin if stdin is not None else ():
+                counts["-l"] += 1
+                counts["-w"] += len(line.split())
+                counts["-c"] += len(line.encode('utf-8')) + 1
+            yield format_counts(counts, None)
+            return
+
+        total = {"-l": 0, "-w": 0, "-c": 0}
+        for path in paths:
+            node, error = self.open_file("wc", path)
+            if error:
+                yield error
+                continue
+            counts = {"-l": 0, "-w": 0, "-c": node.size}
+            in_word = False
+            for chunk in self.vfs.iter_chunks(node):
+                counts["-l"] += chunk.count(b"\n")
+                counts["-w"] += len(chunk.split())
+                # Слово, разрезанное границей блоков, не считаем дважды
+                if in_word and not chunk[:1].isspace():
+                    counts["-w"] -= 1
+                in_word = not chunk[-1:].isspace()
+            for flag in total:
+                total[flag] += counts[flag]
+            yield format_counts(counts, path)
+        if len(paths) > 1:
+            yield format_counts(total, "total")
+
+    def find(self, args):
+        args = list(args)
+
+        # Определение каталога для поиска
+        if args and not args[0].startswith("-"):
+            search_dir = args.pop(0)
+            search_dir = search_dir.strip("/")
+            if search_dir == ".":
+                search_dir = self.cwd.strip("/")
+        else:
+            search_dir = self.cwd
+
+        # Выражение разбирается и компилируется один раз до обхода дерева
+        try:
+            query = FindQuery.parse(args)
+        except FindError as e:
+            yield from e.lines
+            return
+
+        found = False
+        start_node = self.vfs.get(search_dir)
+        if start_node is not None:
+            try:
+                for result in query.search(self.vfs, start_node, search_dir.strip("/"), self.cancel_event):
+                    found = True
+                    yield result
+            finally:
+                self.visited += query.visited
+
+        if not found:
+            yield "No matching files found"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Эмулятор командной оболочки без графического интерфейса.")
+    parser.add_argument("--batch", metavar="SCRIPT", required=True,
+                        help="Скрипт с командами; '-' — читать команды из стандартного ввода")
+    parser.add_argument("--config", default="config.csv", help="Путь к config.csv")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Профилировать выполнение скрипта через cProfile и сохранить статистику в FILE")
+    args = parser.parse_args()
+
+    engine = ShellEngine(args.config)
+    out = sys.stdout
+    output = lambda line: out.write(line + "\n")
+
+    try:
+        if args.batch == "-":
+            with profiled(args.profile):
+                engine.run_script(sys.stdin, output)
+            engine.log_action("Executed script from stdin")
+        else:
+            script_path = os.path.abspath(args.batch)
+            with open(script_path, 'r', encoding='utf-8') as file, profiled(args.profile):
+                engine.run_script(file, output)
+            engine.log_action(f"Executed start script: {script_path}")
+    finally:
+        out.flush()
+        engine.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+from shell_engine import ShellEngine
+from parallel_grep import ContentSearch
+from vfs import VirtualFileSystem, SessionVFS
+
+INTERRUPT = "\x03"  # Строка из одного Ctrl+C прерывает текущую команду сеанса
+OUTPUT_BATCH_LINES = 256  # Столько строк вывода команды отправляется клиенту за раз
+
+
+class SessionEngine(ShellEngine):
+    """Сеанс сервера: своя текущая директория, своё представление VFS и свой лог."""
+
+    def __init__(self, server, session_id):
+        self.server = server
+        self.session_id = session_id
+        super().__init__(server.config_path)
+        # Пул процессов grep -r общий для всех сеансов
+        self.content_search = server.content_search
+
+    def load_config(self):
+        super().load_config()
+        root, ext = os.path.splitext(self.log_file)
+        self.log_file = f"{root}.session{self.session_id}{ext}"
+
+    def load_vfs(self):
+        self.vfs = SessionVFS(self.server.vfs)
+
+    def sync(self, args):
+        yield "sync: changes of a server session are kept in memory and are not written to the archive"
+
+    def shutdown(self):
+        # Общий пул закрывает сервер
+        self.content_search = None
+        super().shutdown()
+
+
+class ShellServer:
+    """Многопользовательский сервер эмулятора поверх asyncio (TCP или Unix-сокет).
+
+    VFS загружается один раз и общая для всех сеансов только на чтение, каждое
+    подключение получает SessionEngine со своим cwd, prev_cwd, копией дерева
+    при записи для mv и логом. Протокол строковый: клиент отправляет команду
+    строкой, сервер отвечает строками вывода и приглашением без перевода
+    строки, как терминал. Команды выполняются в потоках, поэтому долгая
+    команда одного сеанса не задерживает другие.
+    """
+
+    def __init__(self, config_path='config.csv'):
+        self.config_path = config_path
+        with open(config_path, newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                vfs_path = row['Path to VFS Archive']
+        self.vfs = VirtualFileSystem.load(vfs_path)
+        self.content_search = ContentSearch()
+        self.session_ids = itertools.count(1)
+        self.sessions = {}
+        self.server = None
+
+    async def start(self, host=None, port=None, unix_path=None):
+        if unix_path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.content_search.close()
+        self.vfs.close()
+
+    async def read_commands(self, reader, engine, commands):
+        """Читает команды клиента, пока выполняется предыдущая, чтобы Ctrl+C дошёл сразу."""
+        while True:
+            try:
+                line = await reader.readline()
+            except ConnectionError:
+                line = b""
+            if not line:
+                # Клиент отключился: текущая команда прерывается
+                engine.cancel_event.set()
+                await commands.put(None)
+                return
+            command = line.decode('utf-8', errors='replace').strip()
+            if command == INTERRUPT:
+                engine.cancel_event.set()
+            else:
+                await commands.put(command)
+
+    @staticmethod
+    def execute(engine, command, send):
+        """Выполняет команду в рабочем потоке, отправляя вывод пачками по OUTPUT_BATCH_LINES строк."""
+        batch = []
+
+        def output(line):
+            batch.append(line)
+            if len(batch) >= OUTPUT_BATCH_LINES:
+                send(batch[:])
+                batch.clear()
+
+        engine.run_command(command, output)
+        send(batch)
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        session_id = next(self.session_ids)
+        engine = await asyncio.to_thread(SessionEngine, self, session_id)
+        self.sessions[session_id] = engine
+        engine.log_action(f"Session {session_id} connected from {writer.get_extra_info('peername') or 'unix socket'}")
+
+        def send(lines):
+            if lines:
+                data = "".join(line + "\n" for line in lines).encode('utf-8')
+                loop.call_soon_threadsafe(writer.write, data)
+
+        commands = asyncio.Queue()
+        reading = asyncio.create_task(self.read_commands(reader, engine, commands))
+        try:
+            writer.write(engine.prompt_text().encode('utf-8'))
+            await writer.drain()
+            while engine.running:
+                command = await commands.get()
+                if command is None:
+                    break
+                # Пачки вывода ставятся в цикл событий раньше, чем завершение потока,
+                # поэтому приглашение записывается после всего вывода команды
+                await asyncio.to_thread(self.execute, engine, command, send)
+                if engine.running:
+                    writer.write(engine.prompt_text().encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            reading.cancel()
+            del self.sessions[session_id]
+            engine.log_action(f"Session {session_id} closed")
+            await asyncio.to_thread(engine.shutdown)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервер эмулятора: много сеансов над одним образом VFS.")
+    parser.add_argument("--config", default="config.csv", help="Путь к config.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8022)
+    parser.add_argument("--unix", metavar="PATH", help="Слушать Unix-сокет вместо TCP")
+    args = parser.parse_args()
+
+    async def run():
+        server = ShellServer(args.config)
+        await server.start(args.host, args.port, args.unix)
+        address = args.unix or f"{args.host}:{args.port}"
+        print(f"Serving {server.vfs.tar_path} on {address}")
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,24 @@
 import unittest
+import asyncio
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
 from unittest.mock import patch, MagicMock
-from shell_emulator import ShellEmulator
+from shell_emulator import ShellEmulator, OutputBuffer
+from shell_engine import ShellEngine, FindQuery, FindError, CommandCancelled
+from vfs import VirtualFileSystem, VFSNode, ContentCache, SessionVFS, compact
+from session_log import StreamingXMLLog, AsyncLogWriter, NDJSONLog, iter_records, read_index, export_xml
+from logquery import query, parse_time
+from parallel_grep import ContentSearch, GrepOptions
+from name_index import NameIndex, glob_literals
+from bench import generate_archive, run_benchmarks, measure_memory
+from shell_server import ShellServer
+from load_client import connect, read_response, run_load, DEFAULT_COMMANDS
 import tkinter as tk
 
 class TestShellEmulator(unittest.TestCase):
@@ -78,5 +96,603 @@ class TestShellEmulator(unittest.TestCase):
         self.shell.execute_command(command="find -size 1M")
         mock_find.assert_called_with(["-size", "1M"])
 
+class TestShellEngine(unittest.TestCase):
+    # Ядро команд работает без дисплея и без Tkinter
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        tar_path = shutil.copy('papka.tar', self.temp_dir.name)
+        config_path = os.path.join(self.temp_dir.name, 'config.csv')
+        with open(config_path, 'w', newline='') as f:
+            f.write("Path to VFS Archive,Path to Log File,Path to Start Script\n")
+            f.write(f"{tar_path},{os.path.join(self.temp_dir.name, 'log.xml')},start_script.txt\n")
+        self.engine = ShellEngine(config_path)
+
+    def tearDown(self):
+        self.engine.shutdown()
+        self.temp_dir.cleanup()
+
+    def run_lines(self, command):
+        lines = []
+        self.engine.run_command(command, lines.append)
+        return lines
+
+    def test_commands_return_output(self):
+        self.assertEqual(self.run_lines("echo Hello World!"), ["Hello World!"])
+        self.assertEqual(self.run_lines("ls"), ["bin", "jokes", "media"])
+        self.assertEqual(self.run_lines("cd jokes"), [])
+        self.assertEqual(self.engine.prompt_text(), "user@shell:~/jokes$ ")
+        self.assertEqual(self.run_lines("foo"), ["Command not found: foo"])
+
+    def test_run_script_stops_on_exit(self):
+        lines = []
+        self.engine.run_script(["mv bin/data.txt media", "find . -type f -name data*", "exit", "echo never"], lines.append)
+        self.assertIn("papka/media/data.txt", lines)
+        self.assertNotIn("never", lines)
+        self.assertFalse(self.engine.running)
+
+    def test_find_size_and_depth(self):
+        self.assertEqual(self.run_lines("find -type f -size +13 -maxdepth 2"), ["papka/bin/data.txt"])
+        self.assertEqual(self.run_lines("find -mindepth 1 -maxdepth 1"), ["papka/bin", "papka/jokes", "papka/media"])
+        self.assertEqual(self.run_lines("find -type f -size -13 -name print*"), ["papka/bin/print.txt"])
+
+    def test_find_query_glob_is_escaped(self):
+        # Метасимволы регулярных выражений в шаблоне сравниваются буквально
+        query = FindQuery.parse(["-name", "a+b.*"])
+        self.assertTrue(query.matches(VFSNode("a+b.txt")))
+        self.assertFalse(query.matches(VFSNode("aab.txt")))
+        self.assertFalse(query.matches(VFSNode("a+bxtxt")))
+        with self.assertRaises(FindError):
+            FindQuery.parse(["-size", "10X"])
+
+    def test_du(self):
+        self.assertEqual(self.run_lines("du -s bin"), ["4126\tbin"])
+        self.assertEqual(self.run_lines("du --inodes jokes"),
+                         ["1\tjokes/joke1", "1\tjokes/joke2", "1\tjokes/joke3", "3\tjokes"])
+        # Относительные пути с ./ и .. нормализуются, как в других командах
+        self.assertEqual(self.run_lines("du -s ./bin"), ["4126\t./bin"])
+        self.run_lines("cd jokes/joke1")
+        self.assertEqual(self.run_lines("du -s ../../bin"), ["4126\t../../bin"])
+        self.assertEqual(self.run_lines("du --inodes .."), ["1\t../joke1", "1\t../joke2", "1\t../joke3", "3\t.."])
+
+    def test_content_commands_and_pipes(self):
+        self.assertEqual(self.run_lines("cat bin/print.txt"), ["Hello world!"])
+        self.assertEqual(self.run_lines("wc bin/data.txt"), ["0 4 18 bin/data.txt"])
+        self.assertEqual(self.run_lines("grep -n movie jokes/joke1/joke.txt"), ["1:Inseption movie"])
+        self.assertEqual(self.run_lines("find -type f | grep joke | wc -l"), ["3"])
+        self.assertEqual(self.run_lines("ls | tail -n 2"), ["jokes", "media"])
+        self.assertEqual(self.run_lines("cat bin"), ["cat: bin: Is a directory"])
+        self.assertEqual(self.run_lines("ls |"), ["syntax error near unexpected token `|'"])
+
+    def test_small_files_read_through_cache(self):
+        node = self.engine.vfs.get('papka/bin/print.txt')
+        self.assertEqual(self.run_lines("cat bin/print.txt"), ["Hello world!"])
+        self.assertEqual(self.engine.vfs.content_cache.get(node), b"Hello world!")
+        # Повторные команды по маленькому файлу не читают архив
+        with patch.object(self.engine.vfs, 'read_range', side_effect=AssertionError) as read_range:
+            self.assertEqual(self.run_lines("grep -n world bin/print.txt"), ["1:Hello world!"])
+            self.assertEqual(self.run_lines("head -n 1 bin/print.txt"), ["Hello world!"])
+            self.assertEqual(self.run_lines("tail -n 1 bin/print.txt"), ["Hello world!"])
+            self.assertEqual(self.run_lines("wc -c bin/print.txt"), ["12 bin/print.txt"])
+        read_range.assert_not_called()
+
+    def test_grep_recursive(self):
+        self.assertEqual(self.run_lines("grep -r -l movie jokes"),
+                         ["papka/jokes/joke1/joke.txt", "papka/jokes/joke2/joke.txt", "papka/jokes/joke3/joke.txt"])
+        self.assertEqual(self.run_lines("grep -ric HELLO bin"), ["papka/bin/data.txt:0", "papka/bin/print.txt:1"])
+        self.assertEqual(self.run_lines("grep -r --max-results 2 movie"),
+                         ["papka/jokes/joke1/joke.txt:Inseption movie", "papka/jokes/joke2/joke.txt:Batman movie"])
+
+    def test_grep_recursive_matches_plain_grep(self):
+        # grep -r проверяет шаблон по каждой строке, как grep по одному файлу
+        self.assertEqual(self.run_lines("grep -r ^Hello bin"), ["papka/bin/print.txt:Hello world!"])
+        self.assertEqual(self.run_lines("grep -rc ^ jokes"), ["papka/jokes/joke1/joke.txt:1",
+                                                             "papka/jokes/joke2/joke.txt:1",
+                                                             "papka/jokes/joke3/joke.txt:1"])
+
+        tar_path = os.path.join(self.temp_dir.name, 'notes.tar')
+        contents = {"papka/notes/a.txt": "foo\nbar end\nbar\nfoo end\n\n",
+                    "papka/notes/b.txt": "end\nbar foo\nfoo",
+                    "papka/notes/c.txt": "Привет\nfoo привет\n"}
+        with tarfile.open(tar_path, 'w') as tar:
+            for name, text in contents.items():
+                data = text.encode('utf-8')
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        self.engine.vfs = VirtualFileSystem.load(tar_path)
+
+        for flags in ["", "-n", "-v", "-c", "-l", "-vn", "-i"]:
+            for pattern in ["^foo", "foo$", "^", "^$", "end\\sbar", "r\\s", "^ПРИВЕТ"]:
+                expected = []
+                for name in sorted(contents):
+                    plain = self.run_lines(f"grep {flags} {pattern} {name[len('papka/'):]}")
+                    if "-l" in flags:
+                        expected += [name] if plain else []
+                    else:
+                        expected += [f"{name}:{line}" for line in plain]
+                command = f"grep -r{flags[1:]} {pattern} notes"
+                self.assertEqual(self.run_lines(command), expected, command)
+
+    def test_grep_recursive_process_pool(self):
+        files = [item for item in self.engine.vfs.walk(self.engine.vfs.root) if not item[1].is_dir]
+        options = GrepOptions(ignore_case=False, invert=False, files_only=False, count_only=False, numbered=True)
+        search = ContentSearch(workers=2)
+        # Каждый файл — отдельный шард, поиск идёт в пуле даже на маленьком архиве
+        with patch('parallel_grep.PARALLEL_MIN_BYTES', 0), patch('parallel_grep.SHARD_BYTES', 1):
+            try:
+                lines = list(search.search(self.engine.vfs, files, "movie", options))
+                first = list(search.search(self.engine.vfs, files, "o", options, max_results=1))
+            finally:
+                search.close()
+        self.assertEqual(lines, ["papka/jokes/joke1/joke.txt:1:Inseption movie",
+                                 "papka/jokes/joke2/joke.txt:1:Batman movie",
+                                 "papka/jokes/joke3/joke.txt:1:Twinlight movie"])
+        self.assertEqual(first, ["papka/bin/data.txt:1:What does is mean?"])
+
+    def test_content_search_pool_created_once(self):
+        # Потоки сеансов одновременно запрашивают общий пул — создаётся один
+        search = ContentSearch(workers=2)
+        started = threading.Barrier(4)
+
+        def slow_pool(*args, **kwargs):
+            time.sleep(0.05)
+            return MagicMock()
+
+        pools = []
+        with patch('parallel_grep.concurrent.futures.ProcessPoolExecutor', side_effect=slow_pool) as factory:
+            def get_pool():
+                started.wait()
+                pools.append(search._get_pool())
+            threads = [threading.Thread(target=get_pool) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            search.close()
+        self.assertEqual(factory.call_count, 1)
+        self.assertTrue(all(pool is pools[0] for pool in pools))
+        pools[0].shutdown.assert_called_once_with(cancel_futures=True)
+        self.assertIsNone(search.pool)
+
+    def test_time_stats_and_log_metrics(self):
+        lines = self.run_lines("time find -type f | wc -l")
+        self.assertEqual(lines[0], "5")
+        self.assertEqual([line.split("\t")[0] for line in lines[1:]], ["real", "cpu", "visited"])
+        self.assertEqual(lines[-1], "visited\t14")
+
+        self.run_lines("ls")
+        self.run_lines("ls")
+        stats = self.run_lines("stats")
+        self.assertTrue(stats[0].startswith("command"))
+        self.assertEqual([line.split()[:2] for line in stats[1:]], [["find", "|"], ["ls", "2"]])
+
+        self.engine.log_writer.flush()
+        with open(self.engine.log_file, 'rb') as f:
+            log = f.read()
+        self.assertIn(b'command="ls" wall_ms="', log)
+        self.assertIn(b'visited="3"', log)
+
+    def test_cancel_command(self):
+        lines = []
+
+        def output(line):
+            lines.append(line)
+            # Ctrl+C из потока интерфейса после первой строки вывода
+            self.engine.cancel_event.set()
+
+        self.engine.run_command("find", output)
+        self.assertEqual(lines, ["papka", "^C"])
+
+        # Обход find сам проверяет флаг отмены, даже если ничего не выводит
+        self.engine.cancel_event.set()
+        query = FindQuery.parse(["-name", "nothing"])
+        with self.assertRaises(CommandCancelled):
+            list(query.search(self.engine.vfs, self.engine.vfs.root, "", self.engine.cancel_event))
+
+        # Следующая команда выполняется как обычно
+        self.assertEqual(self.run_lines("ls"), ["bin", "jokes", "media"])
+
+    def test_head_and_tail_read_only_needed_chunks(self):
+        big_file = os.path.join(self.temp_dir.name, 'big.txt')
+        with open(big_file, 'w') as f:
+            f.writelines(f"line {i}\n" for i in range(100000))
+        with tarfile.open(self.engine.vfs_path, 'a') as tar:
+            tar.add(big_file, arcname='papka/big.txt')
+        self.engine.vfs.close()
+        self.engine.load_vfs()
+
+        with patch.object(VirtualFileSystem, 'read_range', autospec=True,
+                          side_effect=VirtualFileSystem.read_range) as read_range:
+            self.assertEqual(self.run_lines("head -n 2 big.txt"), ["line 0", "line 1"])
+            self.assertEqual(read_range.call_count, 1)
+            self.assertEqual(self.run_lines("tail -n 2 big.txt"), ["line 99998", "line 99999"])
+            self.assertEqual(read_range.call_count, 2)
+        self.assertEqual(self.run_lines("wc -l big.txt"), ["100000 big.txt"])
+
+class TestOutputBuffer(unittest.TestCase):
+    def test_single_insert_and_scrollback(self):
+        root = MagicMock()
+        widget = MagicMock()
+        output = OutputBuffer(root, widget, max_lines=5)
+
+        output.write("a\nb\n")
+        output.write("c\nd\n")
+        # Вставка откладывается до цикла простоя Tk и выполняется один раз
+        root.after_idle.assert_called_once_with(output.flush)
+        widget.insert.assert_not_called()
+        output.flush()
+        widget.insert.assert_called_once_with(tk.END, "a\nb\nc\nd\n")
+
+        output.write("e\nf\n")
+        output.flush()
+        # Самые старые строки удаляются, чтобы в виджете оставалось не больше 5 строк
+        widget.delete.assert_called_with("1.0", "3.0")
+        self.assertEqual(output.line_count, 5)
+
+class TestVirtualFileSystem(unittest.TestCase):
+    def setUp(self):
+        self.vfs = VirtualFileSystem.from_tar('papka.tar')
+
+    def test_tree_structure(self):
+        # Дети директории берутся из словаря узла, без сканирования всего архива
+        jokes = self.vfs.get('papka/jokes')
+        self.assertTrue(jokes.is_dir)
+        self.assertEqual(list(jokes.children), ['joke1', 'joke2', 'joke3'])
+        self.assertIs(self.vfs.get('papka/jokes/joke1/joke.txt').parent, jokes.children['joke1'])
+        self.assertIsNone(self.vfs.get('papka/nothing'))
+
+    def test_move_directory_with_children(self):
+        # Перемещение директории переносит всё поддерево
+        joke1 = self.vfs.get('papka/jokes/joke1')
+        self.vfs.move(joke1, self.vfs.get('papka/media'), 'joke1')
+        self.assertIsNone(self.vfs.get('papka/jokes/joke1'))
+        self.assertEqual(self.vfs.get('papka/media/joke1/joke.txt').path, 'papka/media/joke1/joke.txt')
+
+        # Агрегаты размеров обновляются у старых и новых предков
+        self.assertEqual(self.vfs.get('papka/jokes').file_count, 2)
+        self.assertEqual(self.vfs.get('papka/media').total_size, 4096 * 3 + 15)
+        self.assertEqual(self.vfs.root.total_size, 4096 * 9 + 72)
+
+        # Нельзя переместить директорию внутрь самой себя
+        media = self.vfs.get('papka/media')
+        with self.assertRaises(ValueError):
+            self.vfs.move(media, media.children['joke1'], 'media')
+
+    def test_index_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tar_path = shutil.copy('papka.tar', temp_dir)
+            VirtualFileSystem.load(tar_path)
+            self.assertTrue(os.path.exists(tar_path + '.vfsidx'))
+
+            # Повторный запуск не читает архив
+            with patch.object(VirtualFileSystem, 'from_tar') as from_tar:
+                vfs = VirtualFileSystem.load(tar_path)
+                from_tar.assert_not_called()
+            self.assertEqual(vfs.get('papka/jokes').file_count, 3)
+            self.assertEqual(vfs.read_content(vfs.get('papka/bin/print.txt')), 'Hello world!')
+            vfs.close()
+
+            # После изменения архива индекс перестраивается
+            with tarfile.open(tar_path, 'a') as tar:
+                tar.add('start_script.txt', arcname='papka/start_script.txt')
+            vfs = VirtualFileSystem.load(tar_path)
+            self.assertIsNotNone(vfs.get('papka/start_script.txt'))
+
+    def test_compressed_archive(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for mode in ('gz', 'bz2', 'xz'):
+                tar_path = os.path.join(temp_dir, f'papka.tar.{mode}')
+                with tarfile.open('papka.tar') as source, tarfile.open(tar_path, 'w:' + mode) as tar:
+                    for member in source.getmembers():
+                        tar.addfile(member, source.extractfile(member) if member.isfile() else None)
+
+                for _ in range(2):  # Холодная загрузка, затем из индекса
+                    vfs = VirtualFileSystem.load(tar_path)
+                    self.assertIsNotNone(vfs.archive)
+                    self.assertEqual(vfs.get('papka/jokes').file_count, 3)
+                    self.assertEqual(vfs.read_content(vfs.get('papka/bin/print.txt')), 'Hello world!')
+                    vfs.close()
+                self.assertTrue(os.path.exists(tar_path + '.vfsidx'))
+
+    def test_sync_overlay_and_compact(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tar_path = shutil.copy('papka.tar', temp_dir)
+            vfs = VirtualFileSystem.load(tar_path)
+            vfs.move(vfs.get('papka/bin/data.txt'), vfs.get('papka/media'), 'data.txt')
+            self.assertEqual(vfs.sync(), 1)
+            vfs.close()
+
+            # Изменения переживают перезапуск благодаря overlay
+            vfs = VirtualFileSystem.load(tar_path)
+            self.assertIsNone(vfs.get('papka/bin/data.txt'))
+            self.assertEqual(vfs.read_content(vfs.get('papka/media/data.txt')), 'What does is mean?')
+            vfs.close()
+
+            # Сжатие переносит изменения в сам архив и удаляет overlay
+            with tarfile.open(tar_path) as tar:
+                before = {name: tar.getmember(name) for name in ('papka/bin/data.txt', 'papka/jokes')}
+            compact(tar_path)
+            self.assertFalse(os.path.exists(tar_path + '.overlay'))
+            with tarfile.open(tar_path) as tar:
+                self.assertIn('papka/media/data.txt', tar.getnames())
+                self.assertNotIn('papka/bin/data.txt', tar.getnames())
+                # Права, владелец и mtime переносятся из исходных заголовков, в том числе у перемещённого файла
+                for old_name, new_name in (('papka/bin/data.txt', 'papka/media/data.txt'), ('papka/jokes', 'papka/jokes')):
+                    old, new = before[old_name], tar.getmember(new_name)
+                    self.assertEqual((new.mode, new.uid, new.gid, new.uname, new.gname, new.mtime),
+                                     (old.mode, old.uid, old.gid, old.uname, old.gname, old.mtime))
+
+    def test_lazy_content(self):
+        # Содержимое не загружается при чтении архива, только по требованию
+        self.assertEqual(self.vfs.content_cache.used_bytes, 0)
+        node = self.vfs.get('papka/bin/print.txt')
+        content = self.vfs.read_content(node)
+        self.assertEqual(len(content.encode('utf-8')), node.size)
+        # В кэше хранятся сырые байты, их размер равен размеру файла
+        self.assertEqual(self.vfs.content_cache.get(node), content.encode('utf-8'))
+        self.assertEqual(self.vfs.content_cache.used_bytes, node.size)
+        self.vfs.close()
+
+    def test_compact_nodes(self):
+        node = self.vfs.get('papka/jokes/joke1')
+        with self.assertRaises(AttributeError):
+            node.extra = 1  # __slots__: у узла нет словаря атрибутов
+        # Одинаковые имена директорий и mtime хранятся одним объектом
+        vfs = VirtualFileSystem()
+        first = vfs.add('a/src/x.txt', is_dir=False, mtime=int('1730000000'))
+        second = vfs.add('b/src/y.txt', is_dir=False, mtime=int('1730000000'))
+        self.assertIs(first.parent.name, second.parent.name)
+        self.assertIs(first.mtime, second.mtime)
+
+    def test_name_index(self):
+        index = NameIndex.build(self.vfs.root)
+        joke_files = [self.vfs.get(f'papka/jokes/joke{i}/joke.txt') for i in (1, 2, 3)]
+        # Точное имя, расширение и подстроки; шаблоны без литералов индекс не обслуживает
+        self.assertCountEqual(index.candidates('joke.txt'), joke_files)
+        self.assertEqual(len(index.candidates('*.txt')), 5)
+        self.assertCountEqual(index.candidates('*ipr*'), [self.vfs.get('papka/media/Kipr2008')])
+        self.assertEqual(index.candidates('*zzz*'), [])
+        self.assertIsNone(index.candidates('?[ab]*'))
+        self.assertEqual(glob_literals('jo[kx]e*.t?t'), ['jo', 'e', '.t', 't'])
+
+        # Результаты через индекс совпадают с обходом, в том же порядке
+        for pattern in ('joke*', '*.txt', '*oke*', 'Kipr2008', '*ipr*'):
+            query = FindQuery.parse(['-name', pattern])
+            scanned = list(query.search(self.vfs, self.vfs.root, ''))
+            indexed = list(query.search_candidates(self.vfs, index.candidates(pattern), self.vfs.root, ''))
+            self.assertEqual(indexed, scanned, pattern)
+
+        # mv поддерживает индекс в актуальном состоянии
+        self.vfs.name_index = index
+        self.vfs.move(self.vfs.get('papka/bin/data.txt'), self.vfs.get('papka/media'), 'data.csv')
+        self.assertEqual(index.candidates('data.txt'), [])
+        self.assertEqual(index.candidates('*.csv'), [self.vfs.get('papka/media/data.csv')])
+        self.assertEqual(len(index.candidates('*ata*')), 1)
+        self.vfs.move(self.vfs.get('papka/bin/print.txt'), self.vfs.get('papka/jokes/joke1'), 'joke.txt')
+        self.assertCountEqual(index.candidates('joke.txt'), [self.vfs.get('papka/jokes/joke1/joke.txt')] + joke_files[1:])
+        self.assertEqual(index.size, 13)
+
+    def test_session_copy_on_write(self):
+        first, second = SessionVFS(self.vfs), SessionVFS(self.vfs)
+        first.move(first.get('papka/jokes/joke1'), first.get('papka/media'), 'joke9')
+        # Перемещение видно только в своём сеансе, общее дерево не меняется
+        self.assertIsNone(first.get('papka/jokes/joke1'))
+        self.assertEqual([path for path, _ in first.walk(first.get('papka/media/joke9'))],
+                         ['papka/media/joke9', 'papka/media/joke9/joke.txt'])
+        self.assertEqual(self.vfs.get('papka/jokes/joke1').name, 'joke1')
+        self.assertIsNotNone(second.get('papka/jokes/joke1'))
+        self.assertEqual(first.get('papka/jokes').file_count, 2)
+        self.assertEqual(self.vfs.get('papka/jokes').file_count, 3)
+        self.assertEqual(first.journal, [["mv", "papka/jokes/joke1", "papka/media/joke9"]])
+        # Копируются только перемещённый узел и предки; остальное дерево общее
+        self.assertIs(first.get('papka/bin'), self.vfs.get('papka/bin'))
+        self.assertIs(first.get('papka/media/joke9/joke.txt'), self.vfs.get('papka/jokes/joke1/joke.txt'))
+        with self.assertRaises(ValueError):
+            first.move(first.get('papka/media'), first.get('papka/media/joke9'), 'media')
+
+        # Узел, полученный до предыдущего mv, указывает на копию сеанса
+        media = second.get('papka/media')
+        second.move(second.get('papka/bin/data.txt'), media, 'data.txt')
+        second.move(second.get('papka/bin/print.txt'), media, 'print.txt')
+        self.assertEqual(list(second.get('papka/media').children), ['Anapa2007', 'Kipr2008', 'data.txt', 'print.txt'])
+        self.assertEqual(second.get('papka/media').file_count, 2)
+        self.assertEqual(list(self.vfs.get('papka/media').children), ['Anapa2007', 'Kipr2008'])
+
+        # Маленькие файлы попадают в кэш своего сеанса, общий кэш не меняется
+        node = first.get('papka/bin/print.txt')
+        self.assertEqual(b"".join(first.iter_chunks(node)), b"Hello world!")
+        self.assertEqual(first.content_cache.get(node), b"Hello world!")
+        self.assertIsNone(second.content_cache.get(node))
+        self.assertEqual(self.vfs.content_cache.used_bytes, 0)
+
+    def test_content_cache_limit(self):
+        cache = ContentCache(10)
+        cache.put('a', '12345')
+        cache.put('b', '12345')
+        cache.get('a')
+        cache.put('c', '123')
+        # Вытесняется давно не использованная запись
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), '12345')
+        self.assertLessEqual(cache.used_bytes, 10)
+
+class TestStreamingXMLLog(unittest.TestCase):
+    def setUp(self):
+        fd, self.log_path = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.log_path)
+
+    def test_append_and_close(self):
+        log = StreamingXMLLog(self.log_path)
+        log.write({"timestamp": "2024-11-04T18:00:00", "command": "ls"})
+        log.write({"timestamp": "2024-11-04T18:00:01", "command": "echo <a & b>", "result": "ok"})
+        log.close()
+
+        # Повторное открытие дописывает записи в тот же корень
+        log = StreamingXMLLog(self.log_path)
+        log.write({"timestamp": "2024-11-04T18:00:02", "command": "exit"})
+        log.close()
+
+        entries = ET.parse(self.log_path).getroot().findall("entry")
+        self.assertEqual([e.get("command") for e in entries], ["ls", "echo <a & b>", "exit"])
+        self.assertEqual(entries[1].get("result"), "ok")
+
+    def test_recover_after_crash(self):
+        log = StreamingXMLLog(self.log_path)
+        log.write({"timestamp": "2024-11-04T18:00:00", "command": "ls"})
+        # Имитируем падение посреди записи: корень не закрыт, запись оборвана
+        log.file.write(b'<entry timestamp="2024-11-04T18:0')
+        log.file.close()
+
+        log = StreamingXMLLog(self.log_path)
+        log.write({"timestamp": "2024-11-04T18:00:05", "command": "cd"})
+        log.close()
+
+        entries = ET.parse(self.log_path).getroot().findall("entry")
+        self.assertEqual([e.get("command") for e in entries], ["ls", "cd"])
+
+    def test_async_writer_batches(self):
+        writer = AsyncLogWriter(StreamingXMLLog(self.log_path), "batched", batch_size=16, flush_interval=0.05)
+        for i in range(100):
+            writer.write({"timestamp": "2024-11-04T18:00:00", "command": f"echo {i}"})
+        writer.flush()
+        with open(self.log_path, 'rb') as f:
+            self.assertEqual(f.read().count(b"<entry"), 100)
+        writer.close()
+
+        entries = ET.parse(self.log_path).getroot().findall("entry")
+        self.assertEqual(entries[-1].get("command"), "echo 99")
+
+class TestNDJSONLog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.temp_dir.name, 'log.ndjson')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    @staticmethod
+    def entry(second, command):
+        return {"timestamp": f"2024-11-04T18:{second // 60:02d}:{second % 60:02d}", "command": command}
+
+    def test_index_and_time_query(self):
+        # Маленький интервал индекса: индексируется почти каждая запись
+        with patch('session_log.INDEX_INTERVAL', 100):
+            log = NDJSONLog(self.log_path)
+            log.write_batch([self.entry(i // 2, f"echo {i}") for i in range(200)])
+            log.close()
+        entries = read_index(self.log_path + '.idx')
+        self.assertGreater(len(entries), 50)
+        self.assertEqual([entry[0] for entry in entries], sorted(entry[0] for entry in entries))
+
+        # Обе записи с граничным временем попадают в выборку, хотя индекс указывает между ними
+        since, until = parse_time("2024-11-04T18:00:30"), parse_time("2024-11-04T18:00:40")
+        commands = [record["command"] for record in iter_records(self.log_path, since, until)]
+        self.assertEqual(commands, [f"echo {i}" for i in range(60, 82)])
+        self.assertEqual([record["command"] for record in query(self.log_path, since, until, "echo 7*")],
+                         [f"echo {i}" for i in range(70, 80)])
+
+    def test_rotation_and_recovery(self):
+        log = NDJSONLog(self.log_path, max_bytes=500, backups=2)
+        for i in range(40):
+            log.write(self.entry(i, f"ls {i}"))
+        log.close()
+        # Старше двух ротированных файлов логи удаляются
+        self.assertTrue(os.path.exists(self.log_path + '.2'))
+        self.assertFalse(os.path.exists(self.log_path + '.3'))
+        commands = [record["command"] for record in iter_records(self.log_path)]
+        self.assertEqual(commands[-1], "ls 39")
+        self.assertEqual(commands, sorted(commands, key=lambda command: int(command.split()[1])))
+
+        # Недописанная строка после падения отбрасывается при следующем открытии
+        with open(self.log_path, 'ab') as f:
+            f.write(b'{"timestamp":"2024-11-04T18:')
+        log = NDJSONLog(self.log_path, max_bytes=500, backups=2)
+        log.write(self.entry(100, "cd"))
+        log.close()
+        self.assertEqual([record["command"] for record in iter_records(self.log_path)][-2:], ["ls 39", "cd"])
+
+        # Экспорт в XML того же вида, что пишет StreamingXMLLog
+        xml_path = os.path.join(self.temp_dir.name, 'export.xml')
+        export_xml(iter_records(self.log_path), xml_path)
+        entries = ET.parse(xml_path).getroot().findall("entry")
+        self.assertEqual(entries[-1].attrib, self.entry(100, "cd"))
+
+class TestShellServer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        tar_path = shutil.copy('papka.tar', self.temp_dir.name)
+        self.config_path = os.path.join(self.temp_dir.name, 'config.csv')
+        with open(self.config_path, 'w', newline='') as f:
+            f.write("Path to VFS Archive,Path to Log File,Path to Start Script\n")
+            f.write(f"{tar_path},{os.path.join(self.temp_dir.name, 'log.xml')},start_script.txt\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_sessions_share_vfs(self):
+        async def command(client, text):
+            reader, writer = client
+            writer.write((text + "\n").encode('utf-8'))
+            await writer.drain()
+            return await read_response(reader)
+
+        async def scenario():
+            server = ShellServer(self.config_path)
+            await server.start('127.0.0.1', 0)
+            address = ('127.0.0.1', server.server.sockets[0].getsockname()[1])
+            try:
+                first = await connect(*address)
+                second = await connect(*address)
+                await read_response(first[0])
+                await read_response(second[0])
+
+                # У каждого сеанса свой cwd и своя копия дерева для mv
+                self.assertEqual(await command(first, "cd jokes"), [])
+                self.assertEqual(await command(first, "mv joke1 joke9"), ["Moved joke1 to joke9"])
+                self.assertEqual(await command(first, "ls"), ["joke2", "joke3", "joke9"])
+                self.assertEqual(await command(second, "ls"), ["bin", "jokes", "media"])
+                self.assertEqual(await command(second, "cd jokes"), [])
+                self.assertEqual(await command(second, "ls"), ["joke1", "joke2", "joke3"])
+                self.assertIsNotNone(server.vfs.get('papka/jokes/joke1'))
+
+                report = await run_load(address, clients=2, repeat=1)
+                self.assertEqual(report["commands"], 2 * len(DEFAULT_COMMANDS))
+                self.assertGreater(report["commands_per_second"], 0)
+
+                for _, writer in (first, second):
+                    writer.write(b"exit\n")
+                    await writer.drain()
+                    writer.close()
+                while server.sessions:
+                    await asyncio.sleep(0.01)
+            finally:
+                await server.close()
+
+        asyncio.run(scenario())
+        # Лог у каждого сеанса свой
+        for session_id in (1, 2, 3, 4):
+            self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, f'log.session{session_id}.xml')))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, 'papka.tar.overlay')))
+
+class TestBenchmark(unittest.TestCase):
+    def test_generate_and_run(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tar_path = os.path.join(temp_dir, 'papka.tar')
+            shape = generate_archive(tar_path, entries=200, depth=2, fanout=5, max_size=100)
+            self.assertEqual(shape["entries"], 200)
+            self.assertEqual(shape["directories"], 31)
+
+            results = run_benchmarks(tar_path, temp_dir, repeat=1, log_entries=10)
+            memory = measure_memory(tar_path)
+            self.assertEqual(memory["index"]["entries"], 200)
+            self.assertGreater(memory["tar"]["bytes_per_entry"], 0)
+            for name in ("load_vfs_cold", "load_vfs_warm", "ls", "cd", "find -name", "mv", "log_action"):
+                self.assertEqual(len(results[name]["runs"]), 1)
+            # Перемещения бенчмарка не сохраняются в overlay
+            self.assertFalse(os.path.exists(tar_path + '.overlay'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,647 @@
+import argparse
+import gc
+import hashlib
+import io
+import json
+import marshal
+import os
+import struct
+import sys
+import tarfile
+from collections import OrderedDict
+from compressed_tar import CompressedArchive, detect_compression
+from name_index import NameIndex
+
+# Индекс VFS, сохраняемый рядом с архивом для быстрого повторного запуска
+INDEX_SUFFIX = ".vfsidx"
+INDEX_MAGIC = b"VFSIDX2\n"
+INDEX_HEADER_BYTES = 64 * 1024
+# Журнал изменений VFS, который ещё не перенесён в сам архив
+OVERLAY_SUFFIX = ".overlay"
+# Размер блока при потоковом чтении содержимого файлов
+CHUNK_SIZE = 64 * 1024
+# Файлы не больше одного блока читаются через LRU-кэш содержимого
+CACHED_FILE_BYTES = CHUNK_SIZE
+# Кэш содержимого у каждого сеанса сервера свой, поэтому меньше обычного
+SESSION_CACHE_BYTES = 4 * 1024 * 1024
+
+
+def archive_key(tar_path):
+    """Ключ кэша: размер и mtime архива плюс хэш его начала (заголовков первых записей)."""
+    stat = os.stat(tar_path)
+    with open(tar_path, 'rb') as f:
+        header_hash = hashlib.sha1(f.read(INDEX_HEADER_BYTES)).hexdigest()
+    return (stat.st_size, stat.st_mtime_ns, header_hash)
+
+
+class VFSNode:
+    """Узел дерева виртуальной файловой системы (файл или директория).
+
+    Узел хранит только своё имя, а не полный путь; атрибуты объявлены через
+    __slots__, поэтому у узла нет собственного словаря. Имена директорий
+    интернируются: одинаковые компоненты пути (src, bin, d0) хранятся в памяти
+    один раз. Имена файлов обычно уникальны, и запись в таблице интернирования
+    для них стоила бы больше, чем экономит.
+    """
+
+    __slots__ = ("name", "parent", "children", "size", "mtime", "offset", "total_size", "file_count")
+
+    def __init__(self, name, parent=None, is_dir=False, size=0, mtime=0, offset=None):
+        self.name = sys.intern(name) if is_dir else name
+        self.parent = parent
+        self.children = {} if is_dir else None  # Имя -> VFSNode, только у директорий
+        self.size = size
+        self.mtime = mtime
+        self.offset = offset  # Смещение данных файла внутри tar-архива
+        # Агрегаты по всем потомкам: суммарный размер и число файлов
+        self.total_size = 0
+        self.file_count = 0
+
+    @property
+    def is_dir(self):
+        return self.children is not None
+
+    @property
+    def path(self):
+        # Полный путь собирается по ссылкам на родителя, O(глубина)
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return "/".join(reversed(parts))
+
+    def ancestors(self):
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def is_ancestor_of(self, other):
+        node = other
+        while node is not None:
+            if node is self:
+                return True
+            node = node.parent
+        return False
+
+
+class ContentCache:
+    """LRU-кэш содержимого файлов (сырые байты) с ограничением по суммарному размеру."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.used_bytes -= len(self.entries.pop(key))
+        if len(value) > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.used_bytes += len(value)
+        while self.used_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.used_bytes -= len(evicted)
+
+
+class VirtualFileSystem:
+    """Дерево VFS: у каждой директории словарь детей, у каждого узла ссылка на родителя."""
+
+    def __init__(self, tar_path=None, cache_limit=16 * 1024 * 1024):
+        self.root = VFSNode("", is_dir=True)
+        self.tar_path = tar_path
+        self.content_cache = ContentCache(cache_limit)
+        self._tar_file = None
+        # Для сжатых архивов содержимое читается через контрольные точки распаковки
+        kind = detect_compression(tar_path) if tar_path else None
+        self.archive = CompressedArchive(tar_path, kind) if kind else None
+        self.journal = []  # Изменения текущего сеанса, ещё не записанные в overlay
+        # Одинаковые mtime (файлы одного архива часто упакованы в одну секунду) хранятся одним объектом
+        self._mtimes = {}
+        self.name_index = None  # Индекс имён для find -name, строится в load()
+
+    @classmethod
+    def load(cls, tar_path, cache_limit=16 * 1024 * 1024, use_index=True, overlay=True):
+        """Загружает VFS из индекса рядом с архивом, а если он устарел — из самого архива.
+
+        Поверх архива применяются изменения, ранее сохранённые командой sync
+        (overlay=False — дерево в точности как в архиве).
+        """
+        if not use_index:
+            vfs = cls.from_tar(tar_path, cache_limit)
+        else:
+            index_path = tar_path + INDEX_SUFFIX
+            key = archive_key(tar_path)
+            vfs = cls.from_index(index_path, key, tar_path, cache_limit)
+            if vfs is None:
+                vfs = cls.from_tar(tar_path, cache_limit)
+                try:
+                    vfs.save_index(index_path, key)
+                except OSError as e:
+                    print(f"Cannot write VFS index {index_path}: {e}")
+        if overlay:
+            vfs.apply_overlay()
+        vfs.name_index = NameIndex.build(vfs.root)
+        return vfs
+
+    @property
+    def overlay_path(self):
+        return self.tar_path + OVERLAY_SUFFIX
+
+    def apply_overlay(self):
+        if self.tar_path is None or not os.path.exists(self.overlay_path):
+            return
+        with open(self.overlay_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    operation, source, destination = json.loads(line)
+                except ValueError:
+                    # Недописанная последняя строка после аварийного завершения
+                    continue
+                if operation != "mv":
+                    continue
+                node = self.get(source)
+                parent_path, _, new_name = destination.rpartition("/")
+                new_parent = self.get(parent_path)
+                if node is None or new_parent is None:
+                    print(f"Cannot apply overlay change: mv {source} {destination}")
+                    continue
+                try:
+                    self.move(node, new_parent, new_name, record=False)
+                except ValueError as e:
+                    print(f"Cannot apply overlay change: mv {source} {destination}: {e}")
+
+    def sync(self):
+        """Дописывает журнал сеанса в overlay рядом с архивом; возвращает число изменений."""
+        if not self.journal or self.tar_path is None:
+            return 0
+        with open(self.overlay_path, 'a', encoding='utf-8') as f:
+            for change in self.journal:
+                f.write(json.dumps(change, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        count = len(self.journal)
+        self.journal.clear()
+        return count
+
+    @classmethod
+    def from_tar(cls, tar_path, cache_limit=16 * 1024 * 1024):
+        # Читаются только заголовки: имя, размер, mtime, тип и смещение данных.
+        # Содержимое файлов подгружается по требованию в read_content.
+        vfs = cls(tar_path, cache_limit)
+        if vfs.archive is not None:
+            # Один последовательный проход распаковки; смещения — в распакованном потоке,
+            # а по пути расставляются контрольные точки для последующего чтения файлов
+            stream = vfs.archive.stream()
+            tar = tarfile.open(fileobj=stream, mode='r|')
+        else:
+            stream = None
+            tar = tarfile.open(tar_path, 'r')
+        with tar:
+            for member in tar:
+                if member.isfile():
+                    vfs.add(member.name, is_dir=False, size=member.size,
+                            mtime=member.mtime, offset=member.offset_data)
+                else:
+                    # Размер метаданных папки
+                    vfs.add(member.name, is_dir=True, size=4096, mtime=member.mtime)
+        if stream is not None:
+            stream.close()
+        vfs.compute_aggregates()
+        return vfs
+
+    def _preorder(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.is_dir:
+                stack.extend(reversed(list(node.children.values())))
+
+    def save_index(self, index_path, key):
+        # Дерево хранится параллельными списками в порядке прямого обхода:
+        # родитель всегда идёт раньше потомков, поэтому дерево восстанавливается за один проход
+        ids = {}
+        names, parents, sizes, mtimes, offsets = [], [], [], [], []
+        dirs = bytearray()
+        for node in self._preorder():
+            ids[id(node)] = len(names)
+            names.append(node.name)
+            parents.append(-1 if node.parent is None else ids[id(node.parent)])
+            dirs.append(node.is_dir)
+            sizes.append(node.size)
+            mtimes.append(node.mtime)
+            offsets.append(node.offset)
+
+        key_blob = marshal.dumps(key)
+        checkpoints = self.archive.restart_points() if self.archive is not None else []
+        payload = marshal.dumps((names, parents, bytes(dirs), sizes, mtimes, offsets, checkpoints))
+        temp_path = index_path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack("<I", len(key_blob)))
+            f.write(key_blob)
+            f.write(payload)
+        os.replace(temp_path, index_path)
+
+    @classmethod
+    def from_index(cls, index_path, key, tar_path, cache_limit=16 * 1024 * 1024):
+        """Восстанавливает дерево из индекса; None, если индекса нет или архив изменился."""
+        try:
+            with open(index_path, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return None
+                (key_length,) = struct.unpack("<I", f.read(4))
+                if marshal.loads(f.read(key_length)) != key:
+                    return None
+                names, parents, dirs, sizes, mtimes, offsets, checkpoints = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError, struct.error):
+            return None
+
+        vfs = cls(tar_path, cache_limit)
+        if vfs.archive is not None:
+            for position, compressed_position in checkpoints:
+                vfs.archive.add_checkpoint(position, compressed_position, None)
+        nodes = [vfs.root]
+        append = nodes.append
+        # Сборщик мусора на время создания миллионов узлов только мешает
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            records = zip(names, parents, dirs, sizes, mtimes, offsets)
+            next(records)  # Корень уже создан
+            shared_mtime = vfs._mtimes.setdefault
+            for name, parent_id, is_dir, size, mtime, offset in records:
+                parent = nodes[parent_id]
+                node = VFSNode(name, parent, is_dir, size, shared_mtime(mtime, mtime), offset)
+                parent.children[name] = node
+                append(node)
+
+            # Агрегаты считаются обратным проходом по тем же спискам
+            for i in range(len(nodes) - 1, 0, -1):
+                node = nodes[i]
+                parent = nodes[parents[i]]
+                parent.total_size += node.size + node.total_size
+                parent.file_count += node.file_count + (0 if dirs[i] else 1)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        return vfs
+
+    def compute_aggregates(self):
+        """Один проход снизу вверх: размеры и число файлов для каждой директории."""
+        order = [node for _, node in self.walk(self.root, "")]
+        for node in reversed(order):
+            if node.is_dir:
+                node.total_size = 0
+                node.file_count = 0
+                for child in node.children.values():
+                    node.total_size += child.size + child.total_size
+                    node.file_count += child.file_count + (0 if child.is_dir else 1)
+
+    @staticmethod
+    def _update_aggregates(start, size_delta, count_delta):
+        # Изменение поддерева затрагивает только цепочку предков, O(глубина)
+        node = start
+        while node is not None:
+            node.total_size += size_delta
+            node.file_count += count_delta
+            node = node.parent
+
+    def read_range(self, node, start, size):
+        """Читает size байт файла начиная с start, не выходя за конец файла."""
+        if node.is_dir or node.offset is None:
+            raise IsADirectoryError(node.path)
+        size = max(0, min(size, node.size - start))
+        if self.archive is not None:
+            return self.archive.read(node.offset + start, size)
+        if self._tar_file is None:
+            self._tar_file = open(self.tar_path, 'rb')
+        self._tar_file.seek(node.offset + start)
+        return self._tar_file.read(size)
+
+    def read_bytes(self, node):
+        return self.read_range(node, 0, node.size)
+
+    def iter_chunks(self, node, start=0, chunk_size=CHUNK_SIZE):
+        """Содержимое файла блоками по chunk_size байт; файл целиком в память не читается.
+
+        Маленькие файлы читаются целиком через кэш: повторные cat/grep по
+        ним не обращаются к архиву.
+        """
+        if not node.is_dir and node.size <= CACHED_FILE_BYTES:
+            content = self.read_cached(node)
+            for position in range(start, len(content), chunk_size):
+                yield content[position:position + chunk_size]
+            return
+        position = start
+        while position < node.size:
+            chunk = self.read_range(node, position, chunk_size)
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+
+    def read_cached(self, node):
+        """Содержимое файла в байтах через LRU-кэш."""
+        content = self.content_cache.get(node)
+        if content is None:
+            content = self.read_bytes(node)
+            self.content_cache.put(node, content)
+        return content
+
+    def read_content(self, node):
+        # В кэше лежат байты: длина совпадает с размером файла, а текст декодируется при чтении.
+        # Не-UTF-8 файлы не должны ломать эмулятор
+        return self.read_cached(node).decode('utf-8', errors='replace')
+
+    def close(self):
+        if self._tar_file is not None:
+            self._tar_file.close()
+            self._tar_file = None
+        if self.archive is not None:
+            self.archive.close()
+
+    @staticmethod
+    def split_path(path):
+        return [part for part in path.split("/") if part and part != "."]
+
+    def get(self, path):
+        node = self.root
+        for part in self.split_path(path):
+            if not node.is_dir:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def parent_of(self, node):
+        return node.parent
+
+    def add(self, path, is_dir, size=0, mtime=0, offset=None):
+        mtime = self._mtimes.setdefault(mtime, mtime)
+        parts = self.split_path(path)
+        if not parts:
+            return self.root
+        parent = self.root
+        # Промежуточные директории могут отсутствовать в архиве как отдельные записи
+        for part in parts[:-1]:
+            child = parent.children.get(part)
+            if child is None:
+                child = VFSNode(part, parent, is_dir=True, size=4096, mtime=mtime)
+                parent.children[part] = child
+            parent = child
+
+        name = parts[-1]
+        existing = parent.children.get(name)
+        if existing is not None and existing.is_dir and is_dir:
+            # Директория уже создана как промежуточная — обновляем метаданные
+            existing.size = size
+            existing.mtime = mtime
+            return existing
+
+        node = VFSNode(name, parent, is_dir=is_dir, size=size, mtime=mtime, offset=offset)
+        parent.children[name] = node
+        return node
+
+    def walk(self, node, path=None):
+        """Обход поддерева в прямом порядке, отдаёт пары (путь, узел)."""
+        if path is None:
+            path = node.path
+        stack = [(path, node)]
+        while stack:
+            current_path, current = stack.pop()
+            yield current_path, current
+            if current.is_dir:
+                prefix = current_path + "/" if current_path else ""
+                for child in reversed(list(current.children.values())):
+                    stack.append((prefix + child.name, child))
+
+    def move(self, node, new_parent, new_name, record=True):
+        if node is self.root:
+            raise ValueError("cannot move root directory")
+        if not new_parent.is_dir:
+            raise ValueError("not a directory")
+        if node.is_dir and node.is_ancestor_of(new_parent):
+            raise ValueError("cannot move a directory to a subdirectory of itself")
+
+        existing = new_parent.children.get(new_name)
+        if existing is node:
+            return node
+        if existing is not None and existing.is_dir:
+            raise ValueError("cannot overwrite directory")
+
+        old_path = node.path if record else None
+        size = node.size + node.total_size
+        count = node.file_count + (0 if node.is_dir else 1)
+        if existing is not None:
+            # Перезаписываемый файл исчезает из дерева
+            self._update_aggregates(new_parent, -existing.size, -1)
+            if self.name_index is not None:
+                self.name_index.remove(existing)
+
+        self._update_aggregates(node.parent, -size, -count)
+        del node.parent.children[node.name]
+        if self.name_index is not None and new_name != node.name:
+            self.name_index.rename(node, node.name, new_name)
+        node.name = sys.intern(new_name) if node.is_dir else new_name
+        node.parent = new_parent
+        new_parent.children[new_name] = node
+        self._update_aggregates(new_parent, size, count)
+        if record:
+            self.journal.append(["mv", old_path, node.path])
+        return node
+
+
+class SessionVFS(VirtualFileSystem):
+    """Представление общего дерева VFS для одного сеанса сервера.
+
+    Общее дерево только читается. mv копирует изменяемые узлы вместе с их
+    предками (path copying), остальные узлы остаются общими для всех сеансов.
+    У общих узлов ссылка на родителя указывает в общее дерево, поэтому родитель
+    в сеансе определяется через copies: общий узел -> его копия в сеансе
+    (копия отображается сама на себя). Сжатый архив (чтение под блокировкой)
+    и индекс имён общие, файл tar и кэш содержимого у сеанса свои. Изменения
+    сеанса не записываются в overlay архива.
+    """
+
+    def __init__(self, shared, cache_limit=SESSION_CACHE_BYTES):
+        super().__init__(None, cache_limit)
+        self.shared = shared
+        self.tar_path = shared.tar_path
+        self.archive = shared.archive
+        self.name_index = shared.name_index
+        self.copies = {}
+        self.root = self._copy(shared.root, None)
+
+    def _copy(self, node, parent):
+        copy = VFSNode.__new__(VFSNode)
+        copy.name = node.name
+        copy.parent = parent
+        copy.children = dict(node.children) if node.is_dir else None
+        copy.size = node.size
+        copy.mtime = node.mtime
+        copy.offset = node.offset
+        copy.total_size = node.total_size
+        copy.file_count = node.file_count
+        self.copies[node] = copy
+        self.copies[copy] = copy
+        return copy
+
+    def _writable(self, node):
+        """Копия узла в сеансе; недостающие копии предков создаются по пути от корня."""
+        chain = []
+        # Узел без копии не перемещался в сеансе, его родитель — общий родитель
+        while node not in self.copies:
+            chain.append(node)
+            node = node.parent
+        parent = self.copies[node]
+        for node in reversed(chain):
+            copy = self._copy(node, parent)
+            parent.children[node.name] = copy
+            parent = copy
+        return parent
+
+    def parent_of(self, node):
+        parent = node.parent
+        return None if parent is None else self.copies.get(parent, parent)
+
+    def node_path(self, node):
+        parts = []
+        node = self.copies.get(node, node)
+        while node is not self.root:
+            parts.append(node.name)
+            node = self.parent_of(node)
+        return "/".join(reversed(parts))
+
+    def walk(self, node, path=None):
+        return super().walk(node, self.node_path(node) if path is None else path)
+
+    def move(self, node, new_parent, new_name, record=True):
+        # Узлы, полученные до предыдущего mv, могли с тех пор получить копии
+        node = self.copies.get(node, node)
+        new_parent = self.copies.get(new_parent, new_parent)
+        if node is self.root:
+            raise ValueError("cannot move root directory")
+        if not new_parent.is_dir:
+            raise ValueError("not a directory")
+        if node.is_dir:
+            ancestor = new_parent
+            while ancestor is not None:
+                if ancestor is node:
+                    raise ValueError("cannot move a directory to a subdirectory of itself")
+                ancestor = self.parent_of(ancestor)
+
+        existing = new_parent.children.get(new_name)
+        if existing is node:
+            return node
+        if existing is not None and existing.is_dir:
+            raise ValueError("cannot overwrite directory")
+
+        old_path = self.node_path(node) if record else None
+        node = self._writable(node)
+        old_parent = node.parent
+        new_parent = self._writable(new_parent)
+        size = node.size + node.total_size
+        count = node.file_count + (0 if node.is_dir else 1)
+        if existing is not None:
+            self._update_aggregates(new_parent, -existing.size, -1)
+
+        # Цепочки предков обоих родителей уже скопированы, агрегаты общего дерева не меняются
+        self._update_aggregates(old_parent, -size, -count)
+        del old_parent.children[node.name]
+        node.name = sys.intern(new_name) if node.is_dir else new_name
+        node.parent = new_parent
+        new_parent.children[new_name] = node
+        self._update_aggregates(new_parent, size, count)
+        # Общий индекс имён описывает общее дерево; после изменений find обходит дерево сеанса
+        self.name_index = None
+        if record:
+            self.journal.append(["mv", old_path, self.node_path(node)])
+        return node
+
+    def sync(self):
+        return 0
+
+    def close(self):
+        # Общий сжатый архив закрывает владелец общего дерева
+        if self._tar_file is not None:
+            self._tar_file.close()
+            self._tar_file = None
+
+
+def compact(tar_path, output_path=None):
+    """Собирает чистый tar с учётом всех изменений из overlay.
+
+    Права, владелец и mtime каждой записи берутся из заголовка исходного
+    архива; новые значения получают только директории, которых в архиве не
+    было отдельной записью. Без output_path архив заменяется на новый,
+    а overlay и индекс удаляются.
+    """
+    vfs = VirtualFileSystem.load(tar_path, overlay=False)
+    # Путь каждого узла в исходном архиве, до переносов из overlay
+    original_paths = {node: path for path, node in vfs.walk(vfs.root, "")}
+    vfs.apply_overlay()
+    with tarfile.open(tar_path, 'r:*') as source_tar:
+        headers = {"/".join(vfs.split_path(member.name)): member for member in source_tar}
+
+    target_path = output_path or tar_path + ".compact"
+    # Новый архив сжимается тем же способом, что и исходный
+    mode = f"w:{vfs.archive.kind}" if vfs.archive is not None else "w"
+    with open(tar_path, 'rb') as source, tarfile.open(target_path, mode) as tar:
+        for path, node in vfs.walk(vfs.root, ""):
+            if node is vfs.root:
+                continue
+            info = tarfile.TarInfo(path)
+            header = headers.get(original_paths.get(node))
+            if header is not None:
+                info.mode = header.mode
+                info.uid, info.gid = header.uid, header.gid
+                info.uname, info.gname = header.uname, header.gname
+                info.mtime = header.mtime
+            else:
+                info.mode = 0o755 if node.is_dir else 0o644
+                info.mtime = node.mtime
+            if node.is_dir:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            else:
+                info.size = node.size
+                if vfs.archive is not None:
+                    tar.addfile(info, io.BytesIO(vfs.read_bytes(node)))
+                else:
+                    # Данные копируются потоком прямо из старого архива
+                    source.seek(node.offset)
+                    tar.addfile(info, source)
+    vfs.close()
+
+    if output_path is None:
+        os.replace(target_path, tar_path)
+        for suffix in (OVERLAY_SUFFIX, INDEX_SUFFIX):
+            if os.path.exists(tar_path + suffix):
+                os.remove(tar_path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание архива виртуальной файловой системы.")
+    parser.add_argument("--compact", metavar="ARCHIVE", required=True,
+                        help="Перенести изменения из overlay в архив")
+    parser.add_argument("-o", "--output", help="Записать результат в отдельный файл вместо замены архива")
+    args = parser.parse_args()
+    compact(args.compact, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,24 @@
 import argparse
+import csv
+import json
+import mmap
 import os
+import re
 import subprocess
+import sys
+from array import array
 from collections import defaultdict
+from itertools import repeat
+
+try:
+    import numpy
+except ImportError:  # Без NumPy closure_report считает на целых числах Python
+    numpy = None
+
+# Поля записи APKINDEX, которые попадают в PackageTable
+FIELD = re.compile(rb"\n([PVSIotDpk]):(.*)")
+# Ограничение версии в токене зависимости или provides (=, >=, <, ~)
+VERSION_CONSTRAINT = re.compile(rb"[<>=~]\S*")
 
 
 def parse_apkindex(apkindex_path):
@@ -23,40 +40,466 @@ def parse_apkindex(apkindex_path):
     return dependencies
 
 
-def resolve_dependencies(dependencies, package_name, resolved=None, seen=None):
-    """Рекурсивно разрешает все транзитивные зависимости."""
+class PackageTable:
+    """Пакеты APKINDEX по столбцам: строка таблицы — номер пакета.
+
+    Строки (имена, версии, origin, токены D: и p:) интернированы: одинаковые
+    имена зависимостей хранятся один раз. Числовые поля (S:, I:, t:) лежат
+    в array без отдельного объекта int на каждое значение. В D: и p: хранятся
+    имена без ограничения версии, конфликты D: сохраняют префикс "!".
+    """
+
+    def __init__(self):
+        self.names = []  # P:
+        self.versions = []  # V:
+        self.sizes = array('Q')  # S: размер архива пакета
+        self.installed_sizes = array('Q')  # I: размер после установки
+        self.origins = []  # o: исходный пакет
+        self.build_times = array('Q')  # t: время сборки
+        self.depends = []  # D: кортежи имён
+        self.provides = []  # p: кортежи имён
+        self.priorities = array('Q')  # k: приоритет провайдера
+        self.ids = {}  # Имя пакета -> номер строки
+
+    def __len__(self):
+        return len(self.names)
+
+    def dependency_map(self):
+        """Словарь пакет -> список зависимостей в виде, который возвращает parse_apkindex."""
+        return {name: list(depends) for name, depends in zip(self.names, self.depends)}
+
+    def provides_index(self):
+        """Словарь токен -> имя пакета, который его предоставляет (so:, cmd:, pc:, виртуальные имена).
+
+        Имя настоящего пакета всегда предоставляет он сам. Если токен есть в p:
+        нескольких пакетов, выбирается пакет с большим k:, при равенстве — с
+        меньшим именем, поэтому результат не зависит от порядка записей.
+        """
+        index = {}
+        names = self.names
+        priorities = self.priorities
+        for package_id, tokens in enumerate(self.provides):
+            for token in tokens:
+                current = index.get(token)
+                if current is None or (-priorities[package_id], names[package_id]) < (-priorities[current], names[current]):
+                    index[token] = package_id
+        providers = {token: names[package_id] for token, package_id in index.items()}
+        providers.update((name, name) for name in self.ids)
+        return providers
+
+    def reverse_dependencies(self, provides=None):
+        """Обратный граф: пакет (или токен без провайдера) -> пакеты, которые от него прямо зависят."""
+        dependencies = self.dependency_map()
+        reverse = defaultdict(list)
+        for name in dependencies:
+            for dep in package_dependencies(dependencies, name, provides):
+                reverse[dep].append(name)
+        return dict(reverse)
+
+
+def parse_package_table(apkindex_path):
+    """Однопроходный разбор APKINDEX на уровне байтов в PackageTable.
+
+    Файл отображается в память (mmap), записи разделяются пустыми строками
+    прямо в байтах, а регулярное выражение выбирает из записи только нужные
+    поля без декодирования остальных строк. Затем каждый столбец декодируется
+    одним вызовом, а имена интернируются.
+    """
+    records = []
+    if os.path.getsize(apkindex_path) > 0:
+        with open(apkindex_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data.find(b"\r\n", 0, 4096) != -1:
+                # Переводы строк Windows: разбираем нормализованную копию
+                data = data[:].replace(b"\r\n", b"\n")
+            end = len(data)
+            position = 0
+            while position < end:
+                stop = data.find(b"\n\n", position)
+                if stop == -1:
+                    stop = end
+                if position:
+                    # Поиск с перевода строки перед записью, чтобы первое поле тоже нашлось
+                    fields = dict(FIELD.findall(data, position - 1, stop))
+                else:
+                    fields = dict(FIELD.findall(b"\n" + data[:stop]))
+                if fields.get(b"P"):
+                    records.append(fields)
+                position = stop + 2
+
+    def column(key, default=b""):
+        # Значения поля всех записей одной строкой байтов, по строке на запись
+        return b"\n".join(map(dict.get, records, repeat(key), repeat(default)))
+
+    def strings(key):
+        return list(map(sys.intern, column(key).decode('utf-8').split("\n")))
+
+    def names(key):
+        lines = VERSION_CONSTRAINT.sub(b"", column(key)).decode('utf-8').split("\n")
+        return list(map(tuple, map(map, repeat(sys.intern), map(str.split, lines))))
+
+    table = PackageTable()
+    if not records:
+        return table
+    table.names = strings(b"P")
+    table.versions = strings(b"V")
+    table.origins = strings(b"o")
+    table.sizes = array('Q', map(int, column(b"S", b"0").split(b"\n")))
+    table.installed_sizes = array('Q', map(int, column(b"I", b"0").split(b"\n")))
+    table.build_times = array('Q', map(int, column(b"t", b"0").split(b"\n")))
+    table.depends = names(b"D")
+    table.provides = names(b"p")
+    table.priorities = array('Q', map(int, column(b"k", b"0").split(b"\n")))
+    table.ids = {name: package_id for package_id, name in enumerate(table.names)}
+    return table
+
+
+def package_dependencies(dependencies, package_name, provides=None):
+    """Прямые зависимости пакета; с provides токены заменяются пакетами-провайдерами.
+
+    Конфликты (!пакет) при этом пропускаются, а повторы и ссылки пакета
+    на самого себя убираются.
+    """
+    deps = dependencies.get(package_name, [])
+    if provides is None:
+        return deps
+    resolved = dict.fromkeys(provides.get(dep, dep) for dep in deps if not dep.startswith("!"))
+    resolved.pop(package_name, None)
+    return list(resolved)
+
+
+def resolve_dependencies(dependencies, package_name, resolved=None, seen=None, provides=None):
+    """Разрешает все транзитивные зависимости обходом в глубину с явным стеком."""
     if resolved is None:
         resolved = set()
     if seen is None:
         seen = set()
 
-    if package_name in seen:
-        return resolved
-    seen.add(package_name)
-
-    for dep in dependencies.get(package_name, []):
-        if dep not in resolved:
-            resolved.add(dep)
-            resolve_dependencies(dependencies, dep, resolved, seen)
+    stack = [package_name]
+    while stack:
+        package_name = stack.pop()
+        if package_name in seen:
+            continue
+        seen.add(package_name)
+        for dep in package_dependencies(dependencies, package_name, provides):
+            if dep not in resolved:
+                resolved.add(dep)
+                stack.append(dep)
 
     return resolved
 
 
-def generate_plantuml_graph(package_name, dependencies):
+class DependencyClosure:
+    """Транзитивные замыкания для многих запросов к одному графу зависимостей.
+
+    Компоненты сильной связности находятся итеративным алгоритмом Тарьяна
+    только в той части графа, которая достижима из запрошенных пакетов,
+    и граф сжимается до ациклического графа компонент. Замыкание компоненты
+    собирается обходом этого графа при первом запросе и запоминается вместе
+    с замыканиями общих компонент по пути; следующие запросы берут готовые
+    замыкания вместо повторного обхода общих подграфов.
+    """
+
+    def __init__(self, dependencies, provides=None):
+        self.dependencies = dependencies
+        self.provides = provides
+        self.edges = {}  # Пакет -> прямые зависимости (после provides)
+        self.component = {}  # Пакет -> номер компоненты
+        self.members = []  # Номер компоненты -> её пакеты
+        self.children = []  # Номер компоненты -> компоненты, от которых она зависит
+        self.cyclic = []  # Номер компоненты -> лежат ли её пакеты на цикле
+        self.parents = []  # Номер компоненты -> число зависящих от неё компонент
+        self.reach = {}  # Номер компоненты -> frozenset её пакетов и всего достижимого
+
+    def successors(self, package_name):
+        deps = self.edges.get(package_name)
+        if deps is None:
+            deps = self.edges[package_name] = package_dependencies(self.dependencies, package_name, self.provides)
+        return deps
+
+    def closure(self, package_name):
+        """То же множество, что resolve_dependencies, но frozenset из кэша."""
+        component = self.component.get(package_name)
+        if component is None:
+            self._condense(package_name)
+            component = self.component[package_name]
+        reach = self._reach(component)
+        if self.cyclic[component]:
+            return reach
+        return reach - {package_name}
+
+    def condense(self, packages):
+        """Находит компоненты всех пакетов из packages; возвращает число компонент.
+
+        Номера компонент идут в обратном топологическом порядке: компонента
+        получает номер позже всех компонент, от которых зависит.
+        """
+        for package_name in packages:
+            if package_name not in self.component:
+                self._condense(package_name)
+        return len(self.members)
+
+    def _reach(self, component):
+        # Замыкания запоминаются для запрошенных компонент и для общих — тех,
+        # от которых зависят несколько компонент. Остальные (звенья цепочек)
+        # входят в замыкание родителя напрямую: иначе цепочка длины n
+        # хранила бы n множеств суммарного размера n^2/2.
+        pending = [component]
+        while pending:
+            top = pending[-1]
+            if top in self.reach:
+                pending.pop()
+                continue
+            result = set()
+            seen = {top}
+            stack = [top]
+            missing = []
+            while stack:
+                current = stack.pop()
+                result.update(self.members[current])
+                for child in self.children[current]:
+                    if child in seen:
+                        continue
+                    seen.add(child)
+                    known = self.reach.get(child)
+                    if known is not None:
+                        result |= known
+                    elif self.parents[child] > 1:
+                        missing.append(child)
+                    else:
+                        stack.append(child)
+            if missing:
+                # Сначала общие компоненты, затем повторная сборка top из них
+                pending.extend(missing)
+            else:
+                self.reach[top] = frozenset(result)
+                pending.pop()
+        return self.reach[component]
+
+    def _condense(self, root):
+        component = self.component
+        index = {root: 0}
+        low = {root: 0}
+        stack = [root]
+        position = {root: 0}  # Пакет -> его место в стеке Тарьяна
+        work = [(root, iter(self.successors(root)))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child in component:
+                    continue  # Компонента уже завершена (в этом или прошлом запросе)
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    position[child] = len(stack)
+                    stack.append(child)
+                    work.append((child, iter(self.successors(child))))
+                    break
+                # Пакет в index, но без компоненты — он ещё в стеке Тарьяна
+                if index[child] < low[node]:
+                    low[node] = index[child]
+            else:
+                work.pop()
+                if work and low[node] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[node]
+                if low[node] == index[node]:
+                    start = position[node]
+                    self._add_component(stack[start:])
+                    del stack[start:]
+
+    def _add_component(self, members):
+        # Тарьян завершает компоненту после всех, от которых она зависит
+        number = len(self.members)
+        for member in members:
+            self.component[member] = number
+        children = {}
+        cyclic = len(members) > 1
+        for member in members:
+            for dep in self.successors(member):
+                other = self.component[dep]
+                if other != number:
+                    children[other] = None
+                elif dep == member:
+                    cyclic = True
+        for other in children:
+            self.parents[other] += 1
+        self.members.append(tuple(members))
+        self.children.append(tuple(children))
+        self.cyclic.append(cyclic)
+        self.parents.append(0)
+
+
+def reverse_closure(reverse, package_name, depth=None):
+    """Пакеты, которые зависят от package_name прямо или транзитивно -> расстояние до него.
+
+    Обход в ширину по обратному графу: время пропорционально ответу, а не
+    размеру индекса. depth ограничивает расстояние (1 — только прямые).
+    """
+    found = {}
+    frontier = [package_name]
+    level = 0
+    while frontier and (depth is None or level < depth):
+        level += 1
+        next_frontier = []
+        for package in frontier:
+            for dependent in reverse.get(package, ()):
+                if dependent not in found and dependent != package_name:
+                    found[dependent] = level
+                    next_frontier.append(dependent)
+        frontier = next_frontier
+    return found
+
+
+def closure_report(table, provides=None):
+    """Размер замыкания и суммы S: и I: для всех пакетов таблицы сразу.
+
+    Замыкание считается вместе с самим пакетом (всё, что будет установлено)
+    и только по пакетам индекса: токены без провайдера не учитываются.
+    Возвращает словарь столбцов names, closure_sizes, download_sizes,
+    installed_sizes.
+    """
+    names, inputs = _closure_inputs(table, provides)
+    if numpy is not None:
+        counts, totals = _closure_totals_numpy(*inputs)
+    else:
+        counts, totals = _closure_totals_int(*inputs)
+    return {"names": names, "closure_sizes": counts,
+            "download_sizes": [total[0] for total in totals], "installed_sizes": [total[1] for total in totals]}
+
+
+def _closure_inputs(table, provides=None):
+    # Имена пакетов (номер бита — место в списке) и аргументы _closure_totals_*:
+    # дети компонент, биты пакетов каждой компоненты, компонента каждого
+    # пакета и размеры S: и I: по номерам битов
+    names = list(table.ids)
+    rows = [table.ids[name] for name in names]
+    engine = DependencyClosure(table.dependency_map(), provides)
+    engine.condense(names)
+    position = {name: bit for bit, name in enumerate(names)}
+    member_bits = [[position[member] for member in members if member in position] for members in engine.members]
+    components = [engine.component[name] for name in names]
+    sizes = [table.sizes[row] for row in rows]
+    installed_sizes = [table.installed_sizes[row] for row in rows]
+    return names, (engine.children, member_bits, components, sizes, installed_sizes)
+
+
+def _closure_totals_numpy(children, member_bits, components, sizes, installed_sizes, block=256):
+    # Строка bits — упакованное битовое множество пакетов замыкания компоненты.
+    # Компоненты пронумерованы в обратном топологическом порядке, поэтому
+    # строки всех детей готовы к моменту OR-свёртки строки родителя.
+    count = len(components)
+    words = (count + 63) // 64
+    bits = numpy.zeros((len(children), words), dtype=numpy.uint64)
+    owner = numpy.repeat(numpy.arange(len(member_bits)), [len(bits_) for bits_ in member_bits])
+    positions = numpy.fromiter((bit for bits_ in member_bits for bit in bits_), dtype=numpy.int64, count=count)
+    numpy.bitwise_or.at(bits, (owner, positions >> 6), numpy.left_shift(numpy.uint64(1), (positions & 63).astype(numpy.uint64)))
+    for component, component_children in enumerate(children):
+        if component_children:
+            bits[component] = numpy.bitwise_or.reduce(bits[[component, *component_children]], axis=0)
+
+    components = numpy.array(components, dtype=numpy.int64)
+    weights = numpy.array([sizes, installed_sizes], dtype=numpy.int64).T
+    dense_weights = weights.astype(numpy.float64)
+    counts = numpy.empty(count, dtype=numpy.int64)
+    totals = numpy.empty((count, 2), dtype=numpy.int64)
+    # Строки пакетов обрабатываются блоками: целиком матрица n x n байт
+    # для 20 тысяч пакетов заняла бы 400 МБ
+    for start in range(0, count, block):
+        part = bits[components[start:start + block]]
+        if hasattr(numpy, "bitwise_count"):
+            part_counts = numpy.bitwise_count(part).sum(axis=1, dtype=numpy.int64)
+        else:
+            part_counts = numpy.unpackbits(part.astype('<u8').view(numpy.uint8), axis=1).sum(axis=1, dtype=numpy.int64)
+        stop = start + len(part)
+        counts[start:stop] = part_counts
+        if part_counts.sum() * 16 < len(part) * count:
+            # Редкие замыкания: распаковываются только ненулевые 64-битные слова,
+            # номера пакетов идут подряд по строкам и суммируются reduceat
+            rows, part_words = numpy.nonzero(part)
+            bytes_ = part[rows, part_words].astype('<u8').view(numpy.uint8).reshape(-1, 8)
+            word_numbers, bit_numbers = numpy.nonzero(numpy.unpackbits(bytes_, axis=1, bitorder='little'))
+            columns = part_words[word_numbers] * 64 + bit_numbers
+            # Каждое замыкание содержит сам пакет, поэтому ни один отрезок не пуст
+            offsets = numpy.concatenate(([0], numpy.cumsum(part_counts)[:-1]))
+            totals[start:stop] = numpy.add.reduceat(weights[columns], offsets, axis=0)
+        else:
+            # Плотные замыкания: умножение битовой матрицы на размеры в float64
+            # через BLAS; суммы точны, пока меньше 2^53 байт
+            unpacked = numpy.unpackbits(part.astype('<u8').view(numpy.uint8), axis=1, bitorder='little')[:, :count]
+            totals[start:stop] = numpy.rint(unpacked.astype(numpy.float64) @ dense_weights)
+    return counts.tolist(), totals.tolist()
+
+
+def _closure_totals_int(children, member_bits, components, sizes, installed_sizes):
+    # Без NumPy то же самое на целых числах Python как битовых множествах
+    bits = []
+    for component, component_children in enumerate(children):
+        mask = 0
+        for bit in member_bits[component]:
+            mask |= 1 << bit
+        for child in component_children:
+            mask |= bits[child]
+        bits.append(mask)
+
+    counts = []
+    totals = []
+    for component in components:
+        mask = bits[component]
+        counts.append(mask.bit_count())
+        download = installed = 0
+        # Номера единичных битов ищутся в двоичной записи маски: find работает
+        # на уровне C, а сдвиги большого целого на каждый бит стоили бы O(n)
+        text = bin(mask)
+        last = len(text) - 1
+        position = text.find("1", 2)
+        while position != -1:
+            bit = last - position
+            download += sizes[bit]
+            installed += installed_sizes[bit]
+            position = text.find("1", position + 1)
+        totals.append((download, installed))
+    return counts, totals
+
+
+def write_closure_report(report, output_path):
+    """Сохраняет closure_report в CSV или JSON (по расширению файла)."""
+    columns = ("names", "closure_sizes", "download_sizes", "installed_sizes")
+    header = ("package", "closure_size", "download_size", "installed_size")
+    rows = zip(*(report[column] for column in columns))
+    if output_path.endswith(".json"):
+        with open(output_path, 'w', encoding='utf-8') as file:
+            json.dump([dict(zip(header, row)) for row in rows], file, indent=1, ensure_ascii=False)
+    else:
+        with open(output_path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+
+def generate_plantuml_graph(package_name, dependencies, provides=None):
     """Генерирует граф в формате PlantUML."""
     graph_lines = ["@startuml", "skinparam linetype ortho"]
     seen = set()
+    # Стек итераторов по зависимостям повторяет порядок строк рекурсивного обхода
+    stack = []
+
+    def alias(package):
+        return package.replace(":", "_").replace(".", "_")
+
+    def enter(package):
+        seen.add(package)
+        graph_lines.append(f'class "{package}" as {alias(package)} {{}}')
+        stack.append((package, iter(package_dependencies(dependencies, package, provides))))
+
+    enter(package_name)
+    while stack:
+        current_package, deps = stack[-1]
+        for dep in deps:
+            graph_lines.append(f'"{current_package}" as {alias(current_package)} --> "{dep}" as {alias(dep)}')
+            if dep not in seen:
+                enter(dep)
+                break
+        else:
+            stack.pop()
 
-    def add_edges(current_package, seen):
-        if current_package in seen:
-            return
-        seen.add(current_package)
-        graph_lines.append(f'class "{current_package}" as {current_package.replace(":", "_").replace(".", "_")} {{}}')
-        for dep in dependencies.get(current_package, []):
-            graph_lines.append(f'"{current_package}" as {current_package.replace(":", "_").replace(".", "_")} --> "{dep}" as {dep.replace(":", "_").replace(".", "_")}')
-            add_edges(dep, seen)
-
-    add_edges(package_name, seen)
     graph_lines.append("@enduml")
     return "\n".join(graph_lines)
 
@@ -107,24 +550,58 @@ def visualize_plantuml(plantuml_content, plantuml_path, output_file):
 def main():
     parser = argparse.ArgumentParser(description="Генератор графов зависимости пакетов Alpine Linux.")
     parser.add_argument("-i", "--input", required=True, help="Путь к файлу APKINDEX")
-    parser.add_argument("-p", "--package", required=True, help="Имя анализируемого пакета")
-    parser.add_argument("-v", "--visualizer", required=True, help="Путь к программе для визуализации PlantUML")
-    parser.add_argument("-o", "--output", required=True, help="Путь для сохранения графа зависимостей (PNG)")
+    parser.add_argument("-p", "--package", help="Имя анализируемого пакета")
+    parser.add_argument("-v", "--visualizer", help="Путь к программе для визуализации PlantUML")
+    parser.add_argument("-o", "--output", help="Путь для сохранения графа зависимостей (PNG)")
+    parser.add_argument("--closure-report", metavar="FILE",
+                        help="Сохранить размеры замыканий и суммы S:/I: всех пакетов в CSV или JSON вместо графа")
+    parser.add_argument("--rdeps", metavar="PACKAGE",
+                        help="Вывести пакеты, которые зависят от PACKAGE прямо или транзитивно, вместо графа")
+    parser.add_argument("--depth", type=int, help="Максимальная глубина для --rdeps (1 — только прямые)")
 
     args = parser.parse_args()
+    if not (args.closure_report or args.rdeps) and not (args.package and args.visualizer and args.output):
+        parser.error("аргументы -p/--package, -v/--visualizer и -o/--output обязательны без --closure-report и --rdeps")
+    if args.depth is not None and not args.rdeps:
+        parser.error("--depth используется только вместе с --rdeps")
+    if args.depth is not None and args.depth < 1:
+        parser.error("--depth должен быть не меньше 1")
 
     # Проверка наличия файла APKINDEX
     if not os.path.isfile(args.input):
         print(f"Ошибка: файл {args.input} не найден.")
         return
 
+    if args.closure_report:
+        table = parse_package_table(args.input)
+        write_closure_report(closure_report(table, table.provides_index()), args.closure_report)
+        print(f"Отчёт по замыканиям {len(table.ids)} пакетов сохранён в {args.closure_report}")
+        return
+
+    if args.rdeps:
+        table = parse_package_table(args.input)
+        provides = table.provides_index()
+        # Токен so:, cmd: или pc: заменяется пакетом, который его предоставляет
+        package = provides.get(args.rdeps, args.rdeps)
+        if package not in table.ids:
+            print(f"Ошибка: пакет {args.rdeps} не найден в APKINDEX.")
+            return
+        dependents = reverse_closure(table.reverse_dependencies(provides), package, args.depth)
+        direct = sum(1 for level in dependents.values() if level == 1)
+        print(f"Зависимых от пакета {package}: {len(dependents)}, из них прямых: {direct}")
+        for name, level in sorted(dependents.items(), key=lambda item: (item[1], item[0])):
+            print(f"{level}\t{name}")
+        return
+
     # Проверка наличия JAR-файла для PlantUML
     if not os.path.isfile(args.visualizer):
         print(f"Ошибка: визуализатор PlantUML {args.visualizer} не найден.")
         return
 
-    # Чтение зависимостей из APKINDEX
-    dependencies = parse_apkindex(args.input)
+    # Чтение зависимостей из APKINDEX и индекса провайдеров so:, cmd:, pc:
+    table = parse_package_table(args.input)
+    dependencies = table.dependency_map()
+    provides = table.provides_index()
 
     # Проверка наличия пакета в зависимостях
     if args.package not in dependencies:
@@ -132,7 +609,7 @@ def main():
         return
 
     # Генерация графа в формате PlantUML
-    plantuml_content = generate_plantuml_graph(args.package, dependencies)
+    plantuml_content = generate_plantuml_graph(args.package, dependencies, provides)
 
     # Визуализация графа с использованием PlantUML
     visualize_plantuml(plantuml_content, args.visualizer, args.output)
@@ -1,8 +1,15 @@
 import unittest
 import os
 import subprocess
+import sys
 from collections import defaultdict
-from Main import parse_apkindex, resolve_dependencies, generate_plantuml_graph, visualize_plantuml
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from Main import (parse_apkindex, parse_package_table, package_dependencies, resolve_dependencies, DependencyClosure,
+                  reverse_closure, closure_report, write_closure_report, _closure_inputs, _closure_totals_int,
+                  _closure_totals_numpy, generate_plantuml_graph, visualize_plantuml)
 
 class TestDependencyVisualizer(unittest.TestCase):
 
@@ -46,6 +53,26 @@ class TestDependencyVisualizer(unittest.TestCase):
         }
         self.assertEqual(dependencies, expected_dependencies)
 
+    def test_parse_package_table(self):
+        table = parse_package_table(self.temp_apkindex_path)
+        self.assertEqual(len(table), 6)
+        self.assertEqual(table.dependency_map(), parse_apkindex(self.temp_apkindex_path))
+        self.assertEqual(table.ids['libncursesw'], 3)
+        self.assertEqual(table.sizes[0], 0)
+
+        # Остальные поля и ограничения версий в D: и p:
+        with open(self.temp_apkindex_path, 'w') as f:
+            f.write("C:Q1abc=\nP:busybox\nV:1.36.1-r15\nS:512000\nI:1024000\no:busybox\nt:1700000000\n")
+            f.write("D:so:libc.musl-x86_64.so.1 apk-tools>=2.14 !busybox-extras\n")
+            f.write("p:/bin/sh cmd:busybox=1.36.1-r15\n\n")
+        table = parse_package_table(self.temp_apkindex_path)
+        self.assertEqual(table.names, ['busybox'])
+        self.assertEqual(table.versions, ['1.36.1-r15'])
+        self.assertEqual((table.sizes[0], table.installed_sizes[0], table.build_times[0]), (512000, 1024000, 1700000000))
+        self.assertEqual(table.origins, ['busybox'])
+        self.assertEqual(table.depends[0], ('so:libc.musl-x86_64.so.1', 'apk-tools', '!busybox-extras'))
+        self.assertEqual(table.provides[0], ('/bin/sh', 'cmd:busybox'))
+
     def test_resolve_dependencies(self):
         dependencies = parse_apkindex(self.temp_apkindex_path)
         resolved = resolve_dependencies(dependencies, 'ncurses-dev')
@@ -55,6 +82,136 @@ class TestDependencyVisualizer(unittest.TestCase):
         }
         self.assertEqual(resolved, expected_resolved)
 
+    def test_resolve_dependencies_with_provides(self):
+        with open(self.temp_apkindex_path, 'w') as f:
+            f.write("P:musl\np:so:libc.musl-x86_64.so.1=1\n\n")
+            f.write("P:busybox-binsh\nk:100\nD:busybox=1.36\np:/bin/sh cmd:sh=1.36\n\n")
+            f.write("P:dash-binsh\nk:60\np:/bin/sh cmd:sh=0.5\n\n")
+            f.write("P:busybox\nD:so:libc.musl-x86_64.so.1\n\n")
+            f.write("P:yash-binsh\nk:100\np:cmd:sh\n\n")
+            f.write("P:alpine-base\nD:/bin/sh !busybox-extras so:libc.musl-x86_64.so.1 musl\n\n")
+        table = parse_package_table(self.temp_apkindex_path)
+        provides = table.provides_index()
+        # Больший k:, при равенстве — меньшее имя
+        self.assertEqual(provides['/bin/sh'], 'busybox-binsh')
+        self.assertEqual(provides['cmd:sh'], 'busybox-binsh')
+        self.assertEqual(provides['musl'], 'musl')
+        dependencies = table.dependency_map()
+        self.assertEqual(package_dependencies(dependencies, 'alpine-base', provides), ['busybox-binsh', 'musl'])
+        resolved = resolve_dependencies(dependencies, 'alpine-base', provides=provides)
+        self.assertEqual(resolved, {'busybox-binsh', 'busybox', 'musl'})
+
+    def test_dependency_closure(self):
+        dependencies = parse_apkindex(self.temp_apkindex_path)
+        closure = DependencyClosure(dependencies)
+        for package in dependencies:
+            self.assertEqual(closure.closure(package), resolve_dependencies(dependencies, package))
+
+        # Цикл a -> b -> c -> a и цепочка длиннее предела рекурсии
+        chain = {f"p{i}": [f"p{i + 1}"] for i in range(5000)}
+        chain.update({"a": ["b"], "b": ["c"], "c": ["a", "p4990"]})
+        closure = DependencyClosure(chain)
+        self.assertEqual(closure.closure("a"), {"a", "b", "c"} | {f"p{i}" for i in range(4990, 5001)})
+        self.assertEqual(len(closure.closure("p0")), 5000)
+        self.assertEqual(resolve_dependencies(chain, "p0"), closure.closure("p0"))
+        self.assertEqual(generate_plantuml_graph("p0", chain).count("-->"), 5000)
+
+    def test_dependency_closure_long_chain(self):
+        # Цепочка глубже предела рекурсии: обход и конденсация итеративные
+        limit = sys.getrecursionlimit()
+        length = limit * 5
+        chain = {f"p{i}": [f"p{i + 1}"] for i in range(length)}
+        closure = DependencyClosure(chain)
+        self.assertEqual(closure.closure("p0"), resolve_dependencies(chain, "p0"))
+        self.assertEqual(sys.getrecursionlimit(), limit)
+        # Каждый пакет — отдельная компонента, а запомнено только замыкание запрошенной:
+        # звенья цепочки не общие, промежуточные множества не строятся
+        self.assertEqual(len(closure.members), length + 1)
+        self.assertEqual(len(closure.reach), 1)
+        self.assertEqual(len(closure.closure(f"p{length - 2}")), 2)
+        self.assertLessEqual(len(closure.reach), len(closure.members))
+
+    def test_closure_report(self):
+        with open(self.temp_apkindex_path, 'w') as f:
+            f.write("P:musl\nS:100\nI:1000\np:so:libc.musl-x86_64.so.1\n\n")
+            f.write("P:a\nS:10\nI:20\nD:b so:libc.musl-x86_64.so.1 so:missing.so\n\n")
+            f.write("P:b\nS:30\nI:40\nD:a\n\n")
+            f.write("P:app\nS:1\nI:2\nD:a musl\n\n")
+        table = parse_package_table(self.temp_apkindex_path)
+        report = closure_report(table, table.provides_index())
+        self.assertEqual(report["names"], ['musl', 'a', 'b', 'app'])
+        self.assertEqual(report["closure_sizes"], [1, 3, 3, 4])
+        self.assertEqual(report["download_sizes"], [100, 140, 140, 141])
+        self.assertEqual(report["installed_sizes"], [1000, 1060, 1060, 1062])
+
+        csv_path = self.temp_apkindex_path + ".csv"
+        try:
+            write_closure_report(report, csv_path)
+            with open(csv_path, encoding='utf-8') as f:
+                self.assertEqual(f.read().splitlines()[:2], ["package,closure_size,download_size,installed_size", "musl,1,100,1000"])
+        finally:
+            os.remove(csv_path)
+
+    def closure_fixture(self):
+        # Первые пакеты с короткими замыканиями, дальние — с длинными (плотные
+        # блоки битовых строк), обратные рёбра дают циклы, часть so: без провайдера
+        with open(self.temp_apkindex_path, 'w') as f:
+            for i in range(200):
+                deps = [f"p{i - 1}", f"p{i * 7 % 100}"] if i > 100 else [f"p{i // 3}"] if i else []
+                if i % 17 == 0:
+                    deps.append(f"p{i + 5}")
+                deps.append("so:libc.musl-x86_64.so.1" if i % 2 else "so:missing.so")
+                f.write(f"P:p{i}\nS:{i * 11 + 1}\nI:{i * 101 + 7}\nD:{' '.join(deps)}\n")
+                if i == 3:
+                    f.write("p:so:libc.musl-x86_64.so.1\n")
+                f.write("\n")
+        table = parse_package_table(self.temp_apkindex_path)
+        provides = table.provides_index()
+        dependencies = table.dependency_map()
+        expected_counts = []
+        expected_totals = []
+        for name in table.ids:
+            closure = {dep for dep in resolve_dependencies(dependencies, name, provides=provides) if dep in table.ids}
+            closure.add(name)
+            rows = [table.ids[dep] for dep in closure]
+            expected_counts.append(len(closure))
+            expected_totals.append([sum(table.sizes[row] for row in rows), sum(table.installed_sizes[row] for row in rows)])
+        return _closure_inputs(table, provides)[1], expected_counts, expected_totals
+
+    def test_closure_totals_int(self):
+        inputs, expected_counts, expected_totals = self.closure_fixture()
+        counts, totals = _closure_totals_int(*inputs)
+        self.assertEqual(counts, expected_counts)
+        self.assertEqual([list(total) for total in totals], expected_totals)
+
+    @unittest.skipUnless(numpy, "NumPy не установлен")
+    def test_closure_totals_numpy(self):
+        inputs, expected_counts, expected_totals = self.closure_fixture()
+        # Маленькие блоки: в разбор попадают и редкие, и плотные блоки строк
+        counts, totals = _closure_totals_numpy(*inputs, block=16)
+        self.assertEqual(counts, expected_counts)
+        self.assertEqual(totals, expected_totals)
+        int_counts, int_totals = _closure_totals_int(*inputs)
+        self.assertEqual((counts, totals), (int_counts, [list(total) for total in int_totals]))
+
+    def test_reverse_closure(self):
+        table = parse_package_table(self.temp_apkindex_path)
+        reverse = table.reverse_dependencies()
+        self.assertEqual(sorted(reverse['so:libncursesw.so.6']), ['libformw', 'libmenuw', 'libpanelw'])
+        self.assertEqual(reverse_closure(reverse, 'ncurses-terminfo-base'),
+                         {'libformw': 1, 'libmenuw': 1, 'libncursesw': 1, 'libpanelw': 1, 'ncurses-dev': 2})
+        self.assertEqual(reverse_closure(reverse, 'ncurses-terminfo-base', depth=1),
+                         {'libformw': 1, 'libmenuw': 1, 'libncursesw': 1, 'libpanelw': 1})
+        self.assertEqual(reverse_closure(reverse, 'ncurses-dev'), {})
+
+        # Через provides so: ведёт к libncursesw, а цикл не возвращает сам пакет
+        with open(self.temp_apkindex_path, 'a') as f:
+            f.write("P:libncursesw\np:so:libncursesw.so.6\nD:libformw\n\n")
+        table = parse_package_table(self.temp_apkindex_path)
+        reverse = table.reverse_dependencies(table.provides_index())
+        self.assertEqual(reverse_closure(reverse, 'libncursesw'),
+                         {'libformw': 1, 'libmenuw': 1, 'libpanelw': 1, 'ncurses-dev': 1})
+
     def test_generate_plantuml_graph(self):
         dependencies = parse_apkindex(self.temp_apkindex_path)
         plantuml_content = generate_plantuml_graph('ncurses-dev', dependencies)
@@ -0,0 +1,86 @@
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from Main import parse_apkindex, parse_package_table, resolve_dependencies, DependencyClosure, closure_report
+
+
+def timed(function, repeat):
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {"runs": runs, "min": min(runs), "median": statistics.median(runs)}
+
+
+def retained_bytes(function):
+    """Память (tracemalloc), которую занимает результат function после разбора."""
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"retained_bytes": current, "peak_bytes": peak}
+
+
+def run_benchmarks(apkindex_path, repeat=10):
+    """Сравнивает parse_apkindex (только P: и D:) и parse_package_table (P, V, S, I, o, t, D, p, k)."""
+    parsers = {"parse_apkindex": parse_apkindex, "parse_package_table": parse_package_table}
+    results = {}
+    for name, parser in parsers.items():
+        results[name] = timed(lambda: parser(apkindex_path), repeat)
+        # Отдельный проход: под tracemalloc разбор в несколько раз медленнее обычного
+        results[name].update(retained_bytes(lambda: parser(apkindex_path)))
+    return results
+
+
+def run_closure_benchmarks(apkindex_path, repeat=10):
+    """Замыкания всех пакетов: отдельный обход на каждый запрос против DependencyClosure."""
+    table = parse_package_table(apkindex_path)
+    dependencies = table.dependency_map()
+    provides = table.provides_index()
+
+    def each():
+        for name in table.names:
+            resolve_dependencies(dependencies, name, provides=provides)
+
+    def memoized():
+        closure = DependencyClosure(dependencies, provides)
+        for name in table.names:
+            closure.closure(name)
+
+    return {"resolve_dependencies": timed(each, repeat), "DependencyClosure": timed(memoized, repeat),
+            "closure_report": timed(lambda: closure_report(table, provides), repeat)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры времени и памяти разбора APKINDEX.")
+    parser.add_argument("-i", "--input", default="APKINDEX", help="Путь к файлу APKINDEX")
+    parser.add_argument("--repeat", type=int, default=10, help="Число повторов каждого замера")
+    parser.add_argument("-o", "--output", help="Файл для результатов в JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "input": args.input,
+        "results": run_benchmarks(args.input, args.repeat),
+        "closure_all_packages": run_closure_benchmarks(args.input, args.repeat),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()